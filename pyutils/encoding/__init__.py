@@ -27,13 +27,22 @@ TODO:
 """
 
 import cgi
+import codecs
+import collections
+import logging
+import multiprocessing
 import re
-import io
 import sys
 import types
 
 from pyutils.xtypes.enum import HashEnum as Enum
 
+try:
+    import chardet
+except ImportError:
+    # guess() falls back to simpler means
+    chardet = None
+
 ContentTypes = Enum(
     # types not fitting in types below
     'Unknown',
@@ -74,6 +83,11 @@ ContentTypes = Enum(
             Mismatches are not necessarily errors as preferences are defined.
             For details see the specifications.
 
+        - ``mismatches``: the pairs of sources whose encodings contradict
+            each other, e.g. ``(('http', 'xml'),)``; sources are
+            ``'http'``, ``'xml'`` and ``'meta'``. Always computed, also
+            without a log.
+
         - ``logtext``: if no log was given log reports are given here
 """
 class EncodingInfo(object):
@@ -83,6 +97,7 @@ class EncodingInfo(object):
             self.meta_encoding = self.meta_media_type =\
             self.xml_encoding =\
                 None
+        self.mismatches = ()
 
     def __str__(self):
         if self.encoding: return self.encoding
@@ -95,7 +110,85 @@ class EncodingInfo(object):
                 self.__class__.__module__, self.__class__.__name__,
                 self.encoding, self.mismatch, id(self))
 
-def detect(content='', response=None, log=None):
+class _CachedEncodingInfo(EncodingInfo):
+    """
+    A read-only ``EncodingInfo``, which ``detect`` hands out to every
+    caller with the same cache key. ``detect`` turns its result into one
+    by assigning the class, rather than copying it.
+    """
+    def __setattr__(self, name, value):
+        raise AttributeError('cached EncodingInfo objects are read-only')
+
+    __delattr__ = __setattr__
+
+class DetectionCache(object):
+    """
+    A size bounded cache of detection results, which drops the least
+    recently used entries first. Pass it as ``cache`` to ``detect`` or
+    ``guess_content_by_mediatype``, but not the same one to both, as the
+    ``hits`` and ``misses`` counting the lookups would mix.
+
+    The ``EncodingInfo`` objects ``detect`` returns from the cache are
+    shared, and therefore read-only.
+
+    >>> cache = DetectionCache(size=100)
+    >>> for i in range(3):
+    ...     info = detect(b'<?xml version="1.0" encoding="ISO-8859-2"?><a/>',
+    ...                   content_type='application/xml', cache=cache)
+    >>> info.encoding, cache.hits, cache.misses, len(cache)
+    ('iso-8859-2', 2, 1, 1)
+    >>> info.encoding = 'utf-8'
+    Traceback (most recent call last):
+    ...
+    AttributeError: cached EncodingInfo objects are read-only
+    """
+    def __init__(self, size=1024):
+        self.size = size
+        self.hits = self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the value cached for ``key``, or ``None``.
+        """
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+def _content_prefix(content):
+    """
+    The start of ``content`` that decides the result of ``detect``, in
+    a hashable form, as part of a cache key.
+    """
+    prefix = content[:_CACHED_PREFIX]
+    if not isinstance(prefix, (str, bytes)):
+        prefix = bytes(prefix)
+    return prefix
+
+## the pairs of sources checked for contradicting encodings
+_MISMATCH_PAIRS = (('http', 'xml'), ('http', 'meta'), ('xml', 'meta'))
+
+_SOURCE_NAMES = {'http': 'HTTP', 'xml': 'XML', 'meta': 'HTML <meta>'}
+
+def detect(content='', response=None, log=None, content_type=None,
+           cache=None, partial=False):
     """
     Finds all encoding related information in given ``text``.
     Uses information in headers of supplied HTTPResponse, possible XML
@@ -112,10 +205,23 @@ def detect(content='', response=None, log=None):
     Parameters
         - ``response``: HTTP response object,
           e.g. ``urllib.urlopen('url')`` or ``urllib2.Request('url')``
+        - ``content_type``: the value of the Content-Type HTTP header, if
+          no ``response`` is given, e.g. ``'text/html; charset=UTF-8'``
         - ``text``: to guess encoding for, might include XML
-          prolog with encoding pseudo attribute or HTML meta element
+          prolog with encoding pseudo attribute or HTML meta element.
+          Preferably the raw ``bytes`` (or a ``bytearray`` or
+          ``memoryview`` of them), which are examined without decoding
         - ``log``: an optional logging logger to which messages may go, if
-          not given then logging is disabled.
+          not given then logging is disabled. Any object with the
+          ``debug``, ``info`` and ``warn`` methods of a logger will do.
+        - ``cache``: an optional ``DetectionCache``, for results by the
+          Content-Type header and the start of the content. Results for
+          which the encoding had to be guessed from all of the content
+          are not cached, cached results are read-only. The cache is not
+          used if a ``log`` is given, so that all messages are logged.
+        - ``partial``: set if ``text`` is only the start of the document,
+          e.g. as buffered by an ``IncrementalDetector``. An encoding
+          guessed from it then allows for the rest, see ``guess``.
 
     Returns instance of ``EncodingInfo``.
 
@@ -175,18 +281,37 @@ def detect(content='', response=None, log=None):
     """
     # setup
     encinfo = EncodingInfo()
+    isEnabledFor = getattr(log, 'isEnabledFor', None)
+    if isEnabledFor is not None and not isEnabledFor(logging.WARNING):
+        # nothing would be logged, so don't even prepare the messages
+        log = None
     #if not log:
     #    logstream = StringIO.StringIO()
     #    log = buildlog(stream=logstream, format='%(message)s')
 
+    # The cache is looked up by the raw Content-Type value, so that a hit
+    # does not even parse it.
+    key = http = None
+    if response:
+        http = find_in_http_response(response, log)
+    if cache is not None and not log:
+        key = http or content_type, _content_prefix(content)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
     # If response headers were passed, take a look at them first. try to infer
     # both the encoding as well as the content type. If the former fails, the
     # latter will be useful for alternative attempts.
     if response:
-        encinfo.http_media_type, encinfo.http_encoding = find_in_http_response(response, log)
+        encinfo.http_media_type, encinfo.http_encoding = http
+        ctype = guess_content_by_mediatype(encinfo.http_media_type)
+    elif content_type:
+        encinfo.http_media_type, encinfo.http_encoding = find_in_content_type(content_type, log)
         ctype = guess_content_by_mediatype(encinfo.http_media_type)
     else:
         ctype = guess_content(content)
+    guessed = False
 
     # For XML content, try to find an encoding in the content itself.
     if ctype == ContentTypes.XMLApplication or ctype == ContentTypes.XMLText:
@@ -205,7 +330,6 @@ def detect(content='', response=None, log=None):
     #
     # Start with the HTTP charset
     encinfo.encoding = encinfo.http_encoding
-    encinfo.mismatch = False
 
     # Use the xml encoding for certain xml content if we were unsuccessful in
     # finding anything better so far.
@@ -222,41 +346,369 @@ def detect(content='', response=None, log=None):
         if not encinfo.encoding:
             encinfo.encoding =  default_for_media_type(encinfo.http_media_type)
         if not encinfo.encoding:
-            encinfo.encoding = guess(content)
+            encinfo.encoding = guess(content, partial=partial)
+            guessed = True
 
     # Finally, try to infer the encoding from the http media type (by use of
     # defaults defined in the standards) for xml and plain text content.
     elif ctype == ContentTypes.XMLText or ctype == ContentTypes.Text:
         if not encinfo.encoding:
-            encinfo.encoding =  default_by_media_type(encinfo.http_media_type)
+            encinfo.encoding =  default_for_media_type(encinfo.http_media_type)
 
     # Check for possible mismatches, e.g. if two possible encoding values
     # from different sources contradict each other, and log a warning if so.
-    if log:
-        if encinfo.http_encoding and encinfo.xml_encoding and\
-           encinfo.http_encoding != encinfo.xml_encoding:
-            encinfo.mismatch = True
-            log.warn('"%s" (HTTP) <> "%s" (XML) encoding mismatch' %
-                     (encinfo.http_encoding, encinfo.xml_encoding))
-        # HTTP + Meta
-        if encinfo.http_encoding and encinfo.meta_encoding and\
-             encinfo.http_encoding != encinfo.meta_encoding:
-            encinfo.mismatch = True
-            log.warn('"%s" (HTTP) <> "%s" (HTML <meta>) encoding mismatch' %
-                     (encinfo.http_encoding, encinfo.meta_encoding))
-        # XML + Meta
-        if encinfo.xml_encoding and encinfo.meta_encoding and\
-             encinfo.xml_encoding != encinfo.meta_encoding:
-            encinfo.mismatch = True
-            log.warn('"%s" (XML) <> "%s" (HTML <meta>) encoding mismatch' %
-                     (encinfo.xml_encoding, encinfo.meta_encoding))
+    mismatches = []
+    for source, other in _MISMATCH_PAIRS:
+        encoding = getattr(encinfo, source + '_encoding')
+        otherEncoding = getattr(encinfo, other + '_encoding')
+        if encoding and otherEncoding and encoding != otherEncoding:
+            mismatches.append((source, other))
+            if log:
+                log.warn('"%s" (%s) <> "%s" (%s) encoding mismatch' % (
+                         encoding, _SOURCE_NAMES[source],
+                         otherEncoding, _SOURCE_NAMES[other]))
+    encinfo.mismatches = tuple(mismatches)
+    encinfo.mismatch = bool(mismatches)
 
     # We're done. Add a final log entry, then return our result object
     if log:
         log.info('Encoding (probably): %s (Mismatch: %s)',
                  encinfo.encoding, encinfo.mismatch)
+    if key is not None and not guessed:
+        encinfo.__class__ = _CachedEncodingInfo
+        cache.put(key, encinfo)
     return encinfo
 
+class IncrementalDetector(object):
+    """
+    Detects the encoding of a document that is fed in chunks of bytes,
+    e.g. as they arrive from the network, so that decoding can start
+    before the whole document is read.
+
+    Only a prefix of at most ``limit`` bytes is buffered, and detection
+    stops as soon as the result is decided:
+
+        - a BOM was found, whatever the content (for HTML, it takes
+          precedence over a ``<meta>`` charset, as in HTML5), or
+        - for XML content, the XML declaration was read (or there is
+          none), or
+        - for HTML and other text, a ``<meta>`` charset was found, or
+          ``HTML_SCAN_LIMIT`` bytes were read (and any ``<meta>``
+          element starting within them), or
+        - nothing more can be learned from the content, e.g. because
+          it is neither XML nor HTML.
+
+    The result is what ``detect`` returns for the buffered prefix.
+
+    Usage::
+
+        detector = IncrementalDetector(response)
+        for chunk in chunks:
+            if detector.feed(chunk):
+                break
+        encinfo = detector.close()
+
+    Instead of a ``response``, the value of its Content-Type header may
+    be passed as ``content_type`` (see ``detect``).
+
+    The detector only looks at the chunks, so all of them still need
+    to be decoded by the caller, or use a ``DecodingReader``.
+
+    >>> detector = IncrementalDetector(content_type='text/html')
+    >>> detector.feed(b'\\xef\\xbb\\xbf<html><head>')
+    True
+    """
+    def __init__(self, response=None, log=None, limit=2048,
+                 content_type=None):
+        self.response = response
+        self.content_type = content_type
+        self.log = log
+        self.limit = limit
+        self.ctype = None
+        if response:
+            self.ctype = guess_content_by_mediatype(
+                find_in_http_response(response)[0])
+        elif content_type:
+            self.ctype = guess_content_by_mediatype(
+                find_in_content_type(content_type)[0])
+        self.reset()
+
+    def reset(self):
+        """
+        Prepare for detecting the encoding of another document.
+        """
+        self.prefix = bytearray()
+        self.done = False
+        self.result = None
+
+    def feed(self, chunk):
+        """
+        Add the next ``chunk`` of bytes. Returns ``True`` once the
+        encoding is decided, after which further chunks are ignored.
+        """
+        if not self.done:
+            self.prefix += chunk[:self.limit - len(self.prefix)]
+            self.done = len(self.prefix) >= self.limit or self._decided()
+        return self.done
+
+    def close(self):
+        """
+        Finish detection, even if not decided yet (e.g. at the end of a
+        short document), and return an ``EncodingInfo``.
+        """
+        if self.result is None:
+            ## if detection stopped early, there is more to the document
+            partial, self.done = self.done, True
+            self.result = detect(self.prefix, self.response, self.log,
+                                 self.content_type, partial=partial)
+        return self.result
+
+    def _decided(self):
+        prefix = self.prefix
+        # The longest BOM takes four bytes, the others start like it.
+        if len(prefix) >= 4 and prefix.startswith(
+                tuple(bom for bom, name in _BOMS)):
+            return True
+        ctype = self.ctype
+        if ctype is None:
+            # ``guess_content`` looks for an XML declaration in the first
+            # 30 characters, and nothing else is examined if there is none.
+            ctype = guess_content(prefix)
+            if ctype == ContentTypes.Unknown:
+                return len(prefix) >= 30
+
+        if ctype in (ContentTypes.XMLApplication, ContentTypes.XMLText):
+            # A BOM (which takes up to four bytes) or anything else than
+            # an XML declaration at the start decides, as does its end.
+            return len(prefix) >= 4 and (
+                not b'<?xml'.startswith(prefix[:5]) or b'?>' in prefix)
+        if ctype in (ContentTypes.HTMLText, ContentTypes.Text):
+            if find_in_html(prefix)[1] is not None:
+                return True
+            ## nothing beyond the scan limit is looked at, except for the
+            ## rest of a <meta> element starting before it
+            return len(prefix) >= HTML_SCAN_LIMIT + _META_START - 1 and \
+                None not in _meta_elements(prefix, HTML_SCAN_LIMIT)
+        return True
+
+class DecodingReader(object):
+    """
+    A file-like object that reads text from the binary ``stream``, and
+    decodes it as it goes, in constant memory.
+
+    The encoding is detected by an ``IncrementalDetector`` from the start
+    of the stream (at most ``limit`` bytes), with the given ``response``
+    or ``content_type``, and is available as ``encoding`` (and the whole
+    ``EncodingInfo`` as ``info``) once the reader is created. If it
+    cannot be detected, the one of a BOM, or else ``default`` is used
+    (also if Python has no codec for the detected one). A BOM is not
+    part of the text.
+
+    The stream is read in chunks of ``chunk_size`` bytes; ``errors`` is
+    passed on to the decoder.
+
+    >>> import io
+    >>> data = '<?xml version="1.0" encoding="ISO-8859-1"?>\\n<a>Grüße</a>\\n'
+    >>> reader = DecodingReader(io.BytesIO(data.encode('iso-8859-1')),
+    ...                         chunk_size=16)
+    >>> reader.encoding
+    'iso-8859-1'
+    >>> list(reader)
+    ['<?xml version="1.0" encoding="ISO-8859-1"?>\\n', '<a>Grüße</a>\\n']
+    >>> reader = DecodingReader(io.BytesIO(b'\\xef\\xbb\\xbfx\\xc3\\xa4y'))
+    >>> reader.encoding, reader.read(2), reader.read()
+    ('utf-8', 'xä', 'y')
+
+    An encoding guessed from the start of the stream allows for the rest,
+    which may hold characters beyond ASCII, or a character may be cut off
+    at the end of the start:
+
+    >>> data = '<p>' + 'x' * 3000 + 'Grüße</p>'
+    >>> reader = DecodingReader(io.BytesIO(data.encode('utf-8')),
+    ...                         content_type='text/html')
+    >>> reader.encoding, reader.read()[-9:]
+    ('utf-8', 'Grüße</p>')
+    >>> data = '<p>' + 'ä' * 1100 + '</p>'
+    >>> reader = DecodingReader(io.BytesIO(data.encode('utf-8')),
+    ...                         content_type='text/html')
+    >>> reader.encoding, reader.read() == data
+    ('utf-8', True)
+    """
+    def __init__(self, stream, response=None, content_type=None, log=None,
+                 errors='strict', default='utf-8', chunk_size=65536,
+                 limit=2048):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        ## the decoded text not read yet is self._buffer[self._pos:]
+        self._buffer = ''
+        self._pos = 0
+
+        detector = IncrementalDetector(response, log, limit, content_type)
+        chunks = []
+        while True:
+            chunk = stream.read(min(chunk_size, limit))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if detector.feed(chunk):
+                break
+        self.info = detector.close()
+        pending = b''.join(chunks)
+
+        ## detect() only looks for a BOM in XML
+        for bom, bomEncoding in _BOMS:
+            if pending.startswith(bom):
+                break
+        else:
+            bom = bomEncoding = None
+
+        encoding = self.info.encoding or bomEncoding or default
+        try:
+            codec = codecs.lookup(encoding)
+        except LookupError:
+            if log:
+                log.warn('Unknown encoding "%s", using "%s"' % (
+                         encoding, default))
+            encoding, codec = default, codecs.lookup(default)
+        self.encoding = encoding
+
+        if bom and codecs.lookup(bomEncoding).name == codec.name:
+            pending = pending[len(bom):]
+        self._pending = pending
+        self._decoder = codec.incrementaldecoder(errors)
+        self._eof = False
+
+    def _fill(self):
+        """
+        Decodes the next chunk into the buffer. Returns ``False`` at the
+        end of the stream.
+        """
+        if self._eof:
+            return False
+        data = self._pending or self.stream.read(self.chunk_size)
+        self._pending = b''
+        self._eof = not data
+        self._buffer = self._buffer[self._pos:] + \
+            self._decoder.decode(data, self._eof)
+        self._pos = 0
+        return not self._eof
+
+    def read(self, size=-1):
+        """
+        Returns up to ``size`` characters, or all of the remaining text.
+        """
+        while size < 0 or len(self._buffer) - self._pos < size:
+            if not self._fill():
+                break
+        start = self._pos
+        if size < 0:
+            self._pos = len(self._buffer)
+        else:
+            self._pos = min(start + size, len(self._buffer))
+        return self._buffer[start:self._pos]
+
+    def readline(self):
+        """
+        Returns the next line, including its ``\\n``, or ``''`` at the end.
+        """
+        start = self._pos
+        while True:
+            end = self._buffer.find('\n', start)
+            if end != -1:
+                start, self._pos = self._pos, end + 1
+                return self._buffer[start:end + 1]
+            ## where the search continues after self._fill()
+            start = len(self._buffer) - self._pos
+            if not self._fill():
+                return self.read()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _detect_document(item):
+    index, (content, content_type) = item
+    return index, detect(content, content_type=content_type)
+
+def _documents(documents, limit):
+    for document in documents:
+        if isinstance(document, tuple):
+            content, content_type = document
+        else:
+            content, content_type = document, None
+        if limit is not None:
+            content = content[:limit]
+        if isinstance(content, memoryview):
+            # memoryviews cannot be sent to other processes
+            content = content.tobytes()
+        yield content, content_type
+
+def iter_detect(documents, workers=None, chunk_size=64, ordered=True,
+                limit=None):
+    """
+    Runs ``detect`` on many documents, on ``workers`` processes (by
+    default one per CPU), which are sent the documents in chunks of
+    ``chunk_size``.
+
+    ``documents`` is an iterable of contents as ``detect`` takes them,
+    or of ``(content, content_type)`` tuples with the value of the
+    Content-Type HTTP header of each (or ``None``). HTTP response
+    objects cannot be sent to other processes. If ``limit`` is given,
+    only the first ``limit`` bytes of every document are sent (and
+    examined).
+
+    Yields ``(index, EncodingInfo)`` tuples, where ``index`` is the
+    position of the document in ``documents``: in that order, or, if
+    ``ordered`` is false, as soon as they are available.
+
+    With ``workers=1`` no processes are started.
+    """
+    items = enumerate(_documents(documents, limit))
+    if workers == 1:
+        for item in items:
+            yield _detect_document(item)
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        if ordered:
+            results = pool.imap(_detect_document, items, chunk_size)
+        else:
+            results = pool.imap_unordered(_detect_document, items, chunk_size)
+        for result in results:
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def detect_many(documents, workers=None, chunk_size=64, limit=None):
+    """
+    Like ``iter_detect``, but returns the list of ``EncodingInfo``
+    objects, in the order of ``documents``.
+
+    >>> infos = detect_many([b'<?xml version="1.0" encoding="ISO-8859-2"?><a/>',
+    ...                      (b'<p>x</p>', 'text/html; charset=UTF-8'),
+    ...                      b'<meta charset="koi8-r">'], workers=2)
+    >>> [info.encoding for info in infos]
+    ['iso-8859-2', 'utf-8', None]
+    """
+    return [info for index, info in
+            iter_detect(documents, workers, chunk_size, True, limit)]
+
 def Log(logname='encutils', level='INFO', stream=sys.stderr, filename=None,
               filemode="w", format='%(levelname)s\t%(message)s'):
     """
@@ -270,8 +722,6 @@ def Log(logname='encutils', level='INFO', stream=sys.stderr, filename=None,
 
     returns a log with the name ``logname``
     """
-    import logging
-
     log = logging.getLogger(logname)
     if filename: handler = logging.FileHandler(filename, filemode)
     else: handler = logging.StreamHandler(stream)
@@ -284,38 +734,47 @@ def Log(logname='encutils', level='INFO', stream=sys.stderr, filename=None,
 
     return log
 
-def guess_content_by_mediatype(media_type):
+## the media types that are classified by their name ...
+_MEDIA_TYPES = {
+    'application/xml': ContentTypes.XMLApplication,
+    'application/xml-dtd': ContentTypes.XMLApplication,
+    'application/xml-external-parsed-entity': ContentTypes.XMLApplication,
+    'text/xml': ContentTypes.XMLText,
+    'text/xml-external-parsed-entity': ContentTypes.XMLText,
+    'text/html': ContentTypes.HTMLText,
+    }
+## ... and the subtypes of the XML types, e.g. application/atom+xml
+_xml_subtype_re = re.compile(r'(?:(application)|text)/.*?\+xml', re.S)
+
+def guess_content_by_mediatype(media_type, cache=None):
     """
     Attempt to convert a mime/media type into one of the content categories
-    we support.
+    we support. An optional ``DetectionCache`` keeps the results by the
+    normalised media type.
     """
     if not media_type:
         return ContentTypes.Unknown;
 
-    xml_application_types = [
-        r'application/.*?\+xml',
-        'application/xml',
-        'application/xml-dtd',
-        'application/xml-external-parsed-entity']
-    xml_text_types = [
-        r'text\/.*?\+xml',
-        'text/xml',
-        'text/xml-external-parsed-entity']
-
     media_type = media_type.strip().lower()
-
-    if media_type in xml_application_types or\
-            re.match(xml_application_types[0], media_type, re.I|re.S|re.X):
-        xmltype = ContentTypes.XMLApplication
-    elif media_type in xml_text_types or\
-            re.match(xml_text_types[0], media_type, re.I|re.S|re.X):
-        xmltype = ContentTypes.XMLText
-    elif media_type == 'text/html':
-        xmltype = ContentTypes.HTMLText
-    elif media_type.startswith('text/'):
-        xmltype = ContentTypes.Text
-    else:
-        xmltype = ContentTypes.Unknown
+    if cache is not None:
+        xmltype = cache.get(media_type)
+        if xmltype is None:
+            xmltype = guess_content_by_mediatype(media_type)
+            cache.put(media_type, xmltype)
+        return xmltype
+
+    xmltype = _MEDIA_TYPES.get(media_type)
+    if xmltype is None:
+        subtype = _xml_subtype_re.match(media_type)
+        if subtype:
+            if subtype.group(1):
+                xmltype = ContentTypes.XMLApplication
+            else:
+                xmltype = ContentTypes.XMLText
+        elif media_type.startswith('text/'):
+            xmltype = ContentTypes.Text
+        else:
+            xmltype = ContentTypes.Unknown
 
     return xmltype
 
@@ -324,9 +783,15 @@ def guess_content(text):
     Checks if a given text is XML (**naive test!**), and returns the result
     as a ContentTypes value. Primarily used if content type could be determined
     a different way.
+
+    ``text`` may also be ``bytes``, ``bytearray`` or a ``memoryview``.
     """
     try:
-        if text[:30].find('<?xml version=') != -1:
+        if isinstance(text, str):
+            found = text.find('<?xml version=', 0, 30) != -1
+        else:
+            found = bytes(text[:30]).find(b'<?xml version=') != -1
+        if found:
             return ContentTypes.XMLApplication
     except:
         pass
@@ -340,8 +805,30 @@ def find_in_http_response(response, log=None):
     available.
     """
     info = response.info()
-    media_type = info.gettype()
-    encoding = info.getparam('charset')
+    if hasattr(info, 'get_content_type'):
+        # Python 3 responses return an ``email.message.Message``
+        media_type = info.get_content_type()
+        encoding = info.get_content_charset()
+    else:
+        media_type = info.gettype()
+        encoding = info.getparam('charset')
+    if encoding:
+        encoding = encoding.lower()
+
+    if log:
+        log.info('HTTP media_type: %s', media_type)
+        log.info('HTTP encoding: %s', encoding)
+
+    return media_type, encoding
+
+def find_in_content_type(content_type, log=None):
+    """
+    Returns ``(media_type, encoding)`` information from the value of a
+    Content-Type HTTP header, e.g. ``'text/html; charset=UTF-8'``.
+    """
+    media_type, params = cgi.parse_header(content_type)
+    media_type = media_type.lower() or None
+    encoding = params.get('charset') # defaults to None
     if encoding:
         encoding = encoding.lower()
 
@@ -351,11 +838,39 @@ def find_in_http_response(response, log=None):
 
     return media_type, encoding
 
+## the BOMs we know, longest first: (bytepattern, name)
+_BOMS = (
+    (b'\x00\x00\xfe\xff', 'utf_32_be'),
+    (b'\xff\xfe\x00\x00', 'utf_32_le'),
+    (b'\xef\xbb\xbf', 'utf-8'),
+    (b'\xfe\xff', 'utf_16_be'),
+    (b'\xff\xfe', 'utf_16_le'),
+    )
+## the same for strings holding the bytes as characters
+_STR_BOMS = tuple((bom.decode('latin-1'), name) for bom, name in _BOMS)
+
+_XML_DECL_PATTERN = r"""
+    ^<\?xml             # w/o BOM, xmldecl starts with <?xml at the first byte
+    .+?                 # some chars (version info), matched minimal
+    encoding=           # encoding attribute begins
+    ["']                # attribute start delimiter
+    (?P<encstr>         # what's matched in the brackets will be named encstr
+     [^"']+              # every character not delimiter (not overly exact!)
+    )                   # closes the brackets pair for the named group
+    ["']                # attribute end delimiter
+    .*?                 # some chars optionally (standalone decl or whitespace)
+    \?>                 # xmldecl end
+    """
+_xml_decl_re = re.compile(_XML_DECL_PATTERN, re.VERBOSE)
+_xml_decl_bytes_re = re.compile(_XML_DECL_PATTERN.encode('ascii'), re.VERBOSE)
+
 def find_in_xml(fp, log=None, fallback_to_default=True):
     """
     Attempts to detect the character encoding of the xml file
     given by a file object fp. fp must not be a codec wrapped file
-    object! fp may also be a string or unicode string
+    object! fp may also be a ``bytes``, ``bytearray`` or ``memoryview``
+    object, which are examined in place, without being decoded or
+    copied, or a string holding the bytes as characters.
 
     The return value can be:
         - if detection of the BOM succeeds, the codec name of the
@@ -374,71 +889,42 @@ def find_in_xml(fp, log=None, fallback_to_default=True):
     which itself is based on Paul Prescotts recipe:
     http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/52257
     """
-    if type(fp) in (str,):
-        fp = io.StringIO(fp)
+    if hasattr(fp, 'read'):
+        ## assume xml declaration fits into the first 2 KB (*cough*)
+        oldFP = fp.tell()
+        fp.seek(0)
+        data = fp.read(2048)
+        fp.seek(oldFP)
+    else:
+        data = fp
 
-    ### detection using BOM
+    if isinstance(data, str):
+        boms, xmlDeclRE = _STR_BOMS, _xml_decl_re
+        head = data[:4]
+    else:
+        boms, xmlDeclRE = _BOMS, _xml_decl_bytes_re
+        head = bytes(data[:4])
 
-    ## the BOMs we know, by their pattern
-    bomDict={ # bytepattern: name
-             (0x00, 0x00, 0xFE, 0xFF) : "utf_32_be",
-             (0xFF, 0xFE, 0x00, 0x00) : "utf_32_le",
-             (0xFE, 0xFF, None, None) : "utf_16_be",
-             (0xFF, 0xFE, None, None) : "utf_16_le",
-             (0xEF, 0xBB, 0xBF, None) : "utf-8",
-            }
-
-    ## go to beginning of file and get the first 4 bytes
-    oldFP = fp.tell()
-    fp.seek(0)
-    (byte1, byte2, byte3, byte4) = tuple(map(ord, fp.read(4)))
-
-    ## try bom detection using 4 bytes, 3 bytes, or 2 bytes
-    bomDetection = bomDict.get((byte1, byte2, byte3, byte4))
-    if not bomDetection:
-        bomDetection = bomDict.get((byte1, byte2, byte3, None))
-        if not bomDetection:
-            bomDetection = bomDict.get((byte1, byte2, None, None))
-
-    ## if BOM detected, we're done :-)
-    if bomDetection:
-        if log:
-            log.info('XML BOM encoding: %s' % bomDetection)
-        fp.seek(oldFP)
-        return bomDetection
+    ### detection using BOM
+    for bom, bomDetection in boms:
+        if head.startswith(bom):
+            if log:
+                log.info('XML BOM encoding: %s', bomDetection)
+            return bomDetection
 
     ## still here? BOM detection failed.
     ##  now that BOM detection has failed we assume one byte character
     ##  encoding behaving ASCII
 
-    ### search xml declaration for encoding attribute
-
-    ## assume xml declaration fits into the first 2 KB (*cough*)
-    fp.seek(0)
-    buffer = fp.read(2048)
-
-    ## set up regular expression
-    xmlDeclPattern = r"""
-    ^<\?xml             # w/o BOM, xmldecl starts with <?xml at the first byte
-    .+?                 # some chars (version info), matched minimal
-    encoding=           # encoding attribute begins
-    ["']                # attribute start delimiter
-    (?P<encstr>         # what's matched in the brackets will be named encstr
-     [^"']+              # every character not delimiter (not overly exact!)
-    )                   # closes the brackets pair for the named group
-    ["']                # attribute end delimiter
-    .*?                 # some chars optionally (standalone decl or whitespace)
-    \?>                 # xmldecl end
-    """
-    xmlDeclRE = re.compile(xmlDeclPattern, re.VERBOSE)
-
-    ## search and extract encoding string
-    match = xmlDeclRE.search(buffer)
-    fp.seek(oldFP)
+    ### search xml declaration (in the first 2 KB) for encoding attribute
+    match = xmlDeclRE.match(data, 0, 2048)
     if match:
-        enc = match.group("encstr").lower()
+        enc = match.group("encstr")
+        if not isinstance(enc, str):
+            enc = enc.decode('latin-1')
+        enc = enc.lower()
         if log:
-            log.info('XML encoding="%s"' % enc)
+            log.info('XML encoding="%s"', enc)
         return enc
     else:
         if fallback_to_default:
@@ -448,42 +934,136 @@ def find_in_xml(fp, log=None, fallback_to_default=True):
         else:
             return None
 
-def find_in_html(text, log=None):
+## like the HTML5 encoding sniffing algorithm, look only at the first KB
+HTML_SCAN_LIMIT = 1024
+
+_META_PATTERN = r'''
+    <meta[\s/]          # a meta element
+    (                   # its attributes, where quoted values may contain >
+     (?:"[^"]*"|'[^']*'|[^'">])*
+    )
+    >
+    '''
+_ATTRIBUTE_PATTERN = r'''
+    ([^\s/>="']+)       # attribute name
+    (?:\s*=\s*          # and optionally its value
+     (?:"([^"]*)"|'([^']*)'|([^\s"'>]+))
+    )?
+    '''
+_meta_re = re.compile(_META_PATTERN, re.I|re.X)
+_attribute_re = re.compile(_ATTRIBUTE_PATTERN, re.X)
+_meta_bytes_re = re.compile(_META_PATTERN.encode('ascii'), re.I|re.X)
+_attribute_bytes_re = re.compile(_ATTRIBUTE_PATTERN.encode('ascii'), re.X)
+## where a meta element starts, and how many characters that takes
+_meta_start_re = re.compile(r'<meta[\s/]', re.I)
+_meta_start_bytes_re = re.compile(br'<meta[\s/]', re.I)
+_META_START = len('<meta ')
+## longer <meta> elements are ignored; with HTML_SCAN_LIMIT, no more than
+## the first 2 KB are looked at (see IncrementalDetector)
+_META_MAX_LENGTH = 1024
+
+## detect() looks at no more of the content, unless it has to guess: the
+## XML declaration is looked for in the first 2 KB as well
+_CACHED_PREFIX = HTML_SCAN_LIMIT + _META_MAX_LENGTH
+
+def _meta_elements(text, limit):
     """
-    Returns (media_type, encoding) information from (first)
-    X/HTML Content-Type ``<meta>`` element if available.
+    Yields the ``<meta>`` elements starting within the first ``limit``
+    characters (or bytes) of ``text``, as matches of the meta pattern,
+    or ``None`` for an element that is not complete, e.g. because the
+    text is cut off in the middle of it.
+
+    Elements longer than ``_META_MAX_LENGTH`` are skipped, so that each
+    takes bounded time to match, also if it is never closed.
+    """
+    if isinstance(text, str):
+        startRE, metaRE = _meta_start_re, _meta_re
+    else:
+        startRE, metaRE = _meta_start_bytes_re, _meta_bytes_re
+    ## the element may end beyond the limit, but not start there
+    for start in startRE.finditer(text, 0, limit + _META_START - 1):
+        end = start.start() + _META_MAX_LENGTH
+        meta = metaRE.match(text, start.start(), end)
+        if meta is not None or len(text) < end:
+            yield meta
+
+def _meta_attributes(attributes, attributeRE):
+    """
+    Returns the attributes of a ``<meta>`` element as a dict, with
+    lowercased names; the first of repeated attributes wins.
+    """
+    result = {}
+    for match in attributeRE.finditer(attributes):
+        name, quoted, singleQuoted, unquoted = match.groups()
+        value = quoted or singleQuoted or unquoted or name[:0]
+        if not isinstance(name, str):
+            name, value = name.decode('latin-1'), value.decode('latin-1')
+        result.setdefault(name.lower(), value.strip())
+    return result
+
+def find_in_html(text, log=None, limit=HTML_SCAN_LIMIT):
+    """
+    Returns (media_type, encoding) information from the first
+    X/HTML ``<meta>`` element declaring it, if available.
+
+    ``text`` may also be ``bytes``, ``bytearray`` or a ``memoryview``.
+    Only elements starting within the first ``limit`` characters (or
+    bytes) are looked at, and none longer than 1 KB, so the time taken
+    does not depend on the size of the document; pass ``limit=None`` to
+    scan all of it.
 
-    Normally in X/HTML:
+    Both forms of the declaration are recognised:
         ``<meta http-equiv="Content-Type" content="media_type;
         charset=encoding"/>``
+
+        ``<meta charset="encoding"/>`` (HTML5, media_type is ``None``)
+
+    >>> find_in_html(b' ' * 1020 + b'<meta charset="koi8-r">')
+    (None, 'koi8-r')
+    >>> find_in_html(b' ' * 1024 + b'<meta charset="koi8-r">')
+    (None, None)
+    >>> find_in_html(b'<meta content="' + b'x' * 1024 + b'" charset="koi8-r">')
+    (None, None)
     """
-    ctmetas = re.findall(r'''(<meta ("[^"]+"|'[^"]+'|[^'">])*
-            http-equiv\s* = \s*['"]\s*Content-Type\s*['"]\s*
-            .*?\/?>)
-        ''', text, re.I|re.S|re.U|re.X)
+    if isinstance(text, str):
+        attributeRE = _attribute_re
+    else:
+        attributeRE = _attribute_bytes_re
+    if limit is None:
+        limit = len(text)
 
     media_type = encoding = None
-    if ctmetas:
-        first = ctmetas[0][0]
-        value = re.findall(r'''
-                content\s*=\s*  # content=
-                ['"]\s*         # " or '
-                (.*?)           # find only value text
-                \s*['"]         # " or '
-            '''
-            ,first, re.I|re.S|re.U|re.X)
-        if value:
-            media_type, params = cgi.parse_header(value[0])
+    for meta in _meta_elements(text, limit):
+        if meta is None:
+            continue
+        attributes = _meta_attributes(meta.group(1), attributeRE)
+        if attributes.get('charset'):
+            encoding = attributes['charset'].lower()
+            if log:
+                log.info('HTML META charset: %s', encoding)
+            break
+        if attributes.get('http-equiv', '').lower() == 'content-type' and\
+                'content' in attributes:
+            value = attributes['content']
+            media_type, params = cgi.parse_header(value)
             encoding = params.get('charset') # defaults to None
             if encoding:
                 encoding = encoding.lower()
             if log:
-                log.debug('HTML <meta>: %s', value[0])
+                log.debug('HTML <meta>: %s', value)
                 log.info('HTML META media_type: %s', media_type)
                 log.info('HTML META encoding: %s', encoding)
+            break
 
     return media_type, encoding
 
+_DEFAULT_ENCODINGS = {
+    ContentTypes.XMLApplication: 'utf-8',
+    # RFC 3023 says 'ascii', but this has always been used
+    ContentTypes.XMLText: 'iso-8859-1', # should be None?
+    ContentTypes.Text: 'iso-8859-1', # should be None?
+    ContentTypes.Unknown: None}
+
 def default_for_media_type(media_type, log=None):
     """
     Returns a default encoding for the given media_type.
@@ -493,15 +1073,8 @@ def default_for_media_type(media_type, log=None):
 
     If no default encoding is available returns ``None``.
     """
-    defaultencodings = {
-        ContentTypes.XMLApplication: 'utf-8',
-        ContentTypes.XMLText: 'ascii',
-        ContentTypes.XMLText: 'iso-8859-1', # should be None?
-        ContentTypes.Text: 'iso-8859-1', # should be None?
-        ContentTypes.Unknown: None}
-
     texttype = guess_content_by_mediatype(media_type)
-    encoding = defaultencodings.get(texttype, None)
+    encoding = _DEFAULT_ENCODINGS.get(texttype, None)
 
     if log:
         if not encoding:
@@ -513,12 +1086,171 @@ def default_for_media_type(media_type, log=None):
                 media_type, encoding)
     return encoding
 
-def guess(text, log=None):
+## guess_bytes() decides from at most this many bytes
+SAMPLE_SIZE = 65536
+
+## the single byte encodings guess_bytes() tells apart, with the characters
+## their texts typically use beyond ASCII, most frequent first; on a tie,
+## the first one wins
+_WESTERN_LETTERS = 'éèàüöäßçñáíóúêâôãõûîïëøåæìòùÿœ'
+_WESTERN_SYMBOLS = '’“”–—…€‘\xa0«»°©®·§'
+_CYRILLIC_LETTERS = 'оеаинтсрвлкмдпуяызьбгчйхжшюцщэфъё'
+_SINGLE_BYTE = (
+    ('iso-8859-1', _WESTERN_LETTERS, '\xa0«»°©®·§'),
+    ('windows-1252', _WESTERN_LETTERS, _WESTERN_SYMBOLS),
+    ('windows-1251', _CYRILLIC_LETTERS, '’“”–—…\xa0«»№'),
+    ('koi8-r', _CYRILLIC_LETTERS, '\xa0'),
+    )
+
+def _byte_weights(encoding, letters, symbols):
+    """
+    Returns a list with a weight for every byte: how much its character
+    in ``encoding`` speaks for a text in that encoding (0 for ASCII).
+    """
+    weights = [0.0] * 0x80
+    for byte in range(0x80, 0x100):
+        char = bytes((byte,)).decode(encoding, 'replace')
+        if char in letters:
+            weight = 2.0 - letters.index(char) / len(letters)
+        elif char.lower() in letters:
+            weight = 0.5
+        elif char in symbols:
+            weight = 0.5
+        elif char == '�' or 0x80 <= ord(char) < 0xa0:
+            # undefined, or a C1 control character
+            weight = -10.0
+        else:
+            weight = -0.5
+        weights.append(weight)
+    return weights
+
+_BYTE_WEIGHTS = [(encoding, _byte_weights(encoding, letters, symbols),
+                  letters is _CYRILLIC_LETTERS)
+                 for encoding, letters, symbols in _SINGLE_BYTE]
+_ASCII = bytes(range(0x80))
+## maps ASCII to 0 and all other bytes to 1
+_HIGH = bytes(0x80) + b'\x01' * 0x80
+
+def _score_single_byte(counts, pairs):
+    """
+    Returns the single byte encodings sorted by how well the ``counts``
+    (a ``Counter``) of the bytes 0x80 to 0xff fit to them, as
+    ``(score, encoding)`` tuples. ``pairs`` is the number of these bytes
+    following another one.
+    """
+    total = sum(counts.values())
+    ## the words of Cyrillic texts are all bytes beyond ASCII, western
+    ## european ones have an accented letter here and there
+    cyrillicText = 2 * pairs > total
+    scores = []
+    for encoding, weights, cyrillic in _BYTE_WEIGHTS:
+        score = sum([weights[b] * c for b, c in counts.items()]) / total
+        if cyrillic != cyrillicText:
+            score -= 1.0
+        scores.append((score, encoding))
+    scores.sort(key=lambda s: s[0], reverse=True)
+    return scores
+
+def guess_bytes(data, sample_size=SAMPLE_SIZE, log=None, partial=False):
+    """
+    Guesses the encoding of ``data`` (``bytes``, ``bytearray`` or a
+    ``memoryview``) from its first ``sample_size`` bytes, without chardet.
+    Set ``partial`` if ``data`` is only the start of a document.
+
+    Recognises BOMs, ASCII, UTF-8 (a sample that decodes as UTF-8 and
+    is not ASCII is hardly anything else) and UTF-16 without BOM. Other
+    data is scored by byte frequencies as windows-1252, iso-8859-1
+    (if none of the windows-1252 characters in 0x80-0x9f are used),
+    windows-1251 or koi8-r; the sample is examined in blocks, and the
+    scoring stops as soon as one of them is clearly ahead.
+
+    If the sample is not all of the document, a character cut off at its
+    end does not count against UTF-8, and ASCII is reported as UTF-8, as
+    the rest of the document may hold other characters.
+
+    Returns ``None`` for empty data.
+
+    >>> guess_bytes(b'plain')
+    'ascii'
+    >>> guess_bytes('Grüße, Zoë'.encode('utf-8'))
+    'utf-8'
+    >>> guess_bytes('Grüße aus München'.encode('iso-8859-1'))
+    'iso-8859-1'
+    >>> guess_bytes('„Grüße“ – Zoë'.encode('windows-1252'))
+    'windows-1252'
+    >>> text = 'Привет, как дела? Всё хорошо.'
+    >>> guess_bytes(text.encode('windows-1251')), guess_bytes(text.encode('koi8-r'))
+    ('windows-1251', 'koi8-r')
+    >>> guess_bytes('hello world'.encode('utf-16-le'))
+    'utf_16_le'
+    >>> guess_bytes('Grüße'.encode('utf-8')[:-1], partial=True)
+    'utf-8'
+    >>> guess_bytes(b'plain', partial=True)
+    'utf-8'
+    """
+    sample = memoryview(data)[:sample_size]
+    if not len(sample):
+        return None
+    head = bytes(sample[:4])
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+
+    sample = bytes(sample)
+    truncated = partial or len(data) > sample_size
+    encoding = None
+    ## first, as UTF-16 text in the Latin script is ASCII and zero bytes
+    if len(sample) > 1:
+        even, odd = sample[0::2].count(0), sample[1::2].count(0)
+        if max(even, odd) > len(sample) // 4:
+            encoding = even > odd and 'utf_16_be' or 'utf_16_le'
+
+    if encoding is None:
+        if sample.isascii():
+            encoding = truncated and 'utf-8' or 'ascii'
+        else:
+            try:
+                ## an incomplete character at the end of a truncated sample
+                ## does not count against UTF-8
+                codecs.getincrementaldecoder('utf-8')().decode(
+                    sample, final=not truncated)
+                encoding = 'utf-8'
+            except UnicodeDecodeError:
+                pass
+
+    if encoding is None:
+        counts = collections.Counter()
+        pairs = 0
+        scores = None
+        for start in range(0, len(sample), 4096):
+            block = sample[start:start + 4096]
+            highBytes = block.translate(None, _ASCII)
+            ## every run of these bytes starts after an ASCII byte
+            ## (or at the start)
+            runs = b'\x00' + block.translate(_HIGH)
+            pairs += len(highBytes) - runs.count(b'\x00\x01')
+            counts.update(highBytes)
+            high = sum(counts.values())
+            if high:
+                scores = _score_single_byte(counts, pairs)
+                if high >= 256 and scores[0][0] - scores[1][0] > 0.5:
+                    break
+        encoding = scores[0][1]
+
+    if log:
+        log.info('Guessed encoding: %s', encoding)
+    return encoding
+
+def guess(text, log=None, partial=False):
     """
     If installed uses chardet http://chardet.feedparser.org/ to detect
-    encoding, else tries different encodings on text and returns the one
-    that does not raise an exception which is not very advanced or may
-    be totally wrong.
+    encoding, else uses ``guess_bytes`` for bytes, or for strings tries
+    different encodings on text and returns the one that does not raise
+    an exception which is not very advanced or may be totally wrong.
+
+    If ``partial`` is set, ``text`` is only the start of a document, and
+    ``utf-8`` is returned instead of ``ascii``, which the rest might not
+    be.
 
     Returns working encoding or None if no encoding does work at all.
 
@@ -527,13 +1259,16 @@ def guess(text, log=None):
     encoding. Some texts might be working in "iso-8859-1" *and*
     "windows-1252" *and* "ascii" *and* "utf-8" and ...
     """
-    try:
-        import chardet
+    if chardet is not None:
+        if isinstance(text, memoryview):
+            text = text.tobytes()
         encoding = chardet.detect(text)["encoding"]
-    except ImportError:
+    else:
         msg = 'Using simplified encoding detection, you might want to install chardet.'
         if log:
             log.warn(msg)
+        if not isinstance(text, str):
+            return guess_bytes(text, log=log, partial=partial)
 
         encodings = (
             'ascii',
@@ -551,4 +1286,6 @@ def guess(text, log=None):
                 encoding = e
                 break
 
+    if partial and encoding == 'ascii':
+        encoding = 'utf-8'
     return encoding
\ No newline at end of file
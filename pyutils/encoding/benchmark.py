@@ -0,0 +1,377 @@
+"""Benchmarks for ``pyutils.encoding``.
+
+Run as a script to execute all benchmarks:
+
+    python -m pyutils.encoding.benchmark
+
+or, to measure encoding guessing on a corpus of your own:
+
+    python -m pyutils.encoding.benchmark path/to/corpus
+
+Each benchmark is also available as a function that returns its
+results as a list of ``(name, value)`` tuples, in case they should be
+recorded somewhere.
+
+``guess_bytes()`` is compared against chardet, if it is installed.
+"""
+
+import codecs
+import os
+import random
+import re
+import sys
+import time
+
+from . import ContentTypes, DetectionCache, default_for_media_type, \
+     detect, guess_bytes, guess_content_by_mediatype
+
+
+__all__ = ('MEDIA_TYPES', 'DOCUMENTS', 'TEXTS', 'HELD_OUT_TEXTS',
+           'random_corpus', 'read_corpus', 'benchmark_media_types', 'benchmark_cache',
+           'benchmark_guess', 'run',)
+
+
+# Content-Type header values as they come with crawled responses,
+# roughly in the proportions they are seen.
+MEDIA_TYPES = (
+    ['text/html'] * 40 +
+    ['text/html; charset=UTF-8', 'TEXT/HTML', ' text/html '] * 5 +
+    ['application/xhtml+xml', 'application/rss+xml', 'application/atom+xml',
+     'application/xml', 'text/xml', 'application/xml-dtd'] * 3 +
+    ['text/plain', 'text/css', 'text/javascript', 'text/csv'] * 2 +
+    ['application/json', 'application/javascript', 'image/png', 'image/jpeg',
+     'application/octet-stream', 'application/pdf'] * 2 +
+    ['text/vnd.wap.wml', 'text/x-opml+xml', 'application/xml-external-parsed-entity'])
+
+
+# Documents whose encoding detect() finds without guessing, with their
+# Content-Type header values.
+DOCUMENTS = (
+    ('xml', b'<?xml version="1.0" encoding="ISO-8859-2"?>\n<feed>' +
+     b'<entry><title>x</title></entry>' * 200 + b'</feed>',
+     'application/rss+xml'),
+    ('html', b'<!DOCTYPE html>\n<html><head><title>x</title>\n'
+     b'<meta http-equiv="Content-Type" content="text/html; charset=windows-1251">'
+     b'</head><body>' + b'<p>text</p>\n' * 500 + b'</body></html>',
+     'text/html'),
+    ('html, charset in header', b'<!DOCTYPE html>\n<html><body>' +
+     b'<p>text</p>\n' * 500 + b'</body></html>', 'text/html; charset=UTF-8'),
+    )
+
+
+# Sample sentences, and the encodings texts in their language are
+# written in. The tables of ``guess_bytes()`` were tuned on these.
+TEXTS = {
+    'english': (('ascii', 'utf-8'), """
+        The quick brown fox jumps over the lazy dog. Encoding detection is
+        easy as long as nobody uses anything but plain ASCII. Most of the
+        web has moved to UTF-8 by now, but archived crawls are another
+        story. Please find the report attached to this message.
+        """),
+    'german': (('iso-8859-1', 'windows-1252', 'utf-8'), """
+        Grüße aus München! Die Straßenbahn fährt über die Brücke.
+        Der Bär läuft durch den Wald und frisst süße Beeren.
+        Könnten Sie mir bitte die Unterlagen schicken? Schöne Grüße.
+        Die Größe des Gebäudes überrascht jeden Besucher.
+        „Das ist ein Zitat“ – sagte er, und es kostete 5 €.
+        """),
+    'french': (('iso-8859-1', 'windows-1252', 'utf-8'), """
+        Le garçon a mangé une crème brûlée à la fenêtre de l'hôtel.
+        Où est la bibliothèque ? Elle est près de l'école élémentaire.
+        Nous étions très contents de voir le théâtre en été.
+        C’est déjà la fin de l’année… « Très bien », dit-elle.
+        """),
+    'spanish': (('iso-8859-1', 'windows-1252', 'utf-8'), """
+        El niño comió una manzana en la montaña. ¿Dónde está la estación?
+        La canción fue muy famosa en toda España. ¡Qué día tan bonito!
+        Mañana vamos a visitar a nuestra familia en Málaga.
+        """),
+    'russian': (('windows-1251', 'koi8-r', 'utf-8'), """
+        Съешь же ещё этих мягких французских булок да выпей чаю.
+        Москва является столицей Российской Федерации и крупнейшим
+        городом страны. Вчера мы гуляли по парку и разговаривали о
+        погоде. Пожалуйста, пришлите мне отчёт до конца недели.
+        В лесу родилась ёлочка, в лесу она росла.
+        """),
+    }
+
+
+# Texts like ``TEXTS``, which were not looked at while tuning
+# ``guess_bytes()``, to measure its accuracy on. Some of the languages
+# use letters the tables do not know about.
+HELD_OUT_TEXTS = {
+    'english': (('ascii', 'utf-8'), """
+        Shipping usually takes three to five business days. If your order
+        has not arrived by then, contact our support team with the order
+        number. Returns are accepted within thirty days of delivery.
+        """),
+    'portuguese': (('iso-8859-1', 'windows-1252', 'utf-8'), """
+        A informação não está disponível no momento. Por favor, tente
+        novamente mais tarde. As crianças brincavam na praça ao pôr do sol.
+        São Paulo é a maior cidade do Brasil e também da América do Sul.
+        """),
+    'italian': (('iso-8859-1', 'windows-1252', 'utf-8'), """
+        Perché non vieni con noi alla spiaggia domenica? Sarà una bella
+        giornata. La città è piena di turisti in questo periodo dell'anno.
+        Il caffè più buono si beve al bar dell'angolo, così dicono tutti.
+        """),
+    'danish': (('iso-8859-1', 'windows-1252', 'utf-8'), """
+        Vi så en rød bil køre forbi huset i går aftes. Hvornår åbner
+        butikken på søndag? Børnene spiste æbler og jordbær i haven.
+        """),
+    'swedish': (('iso-8859-1', 'windows-1252', 'utf-8'), """
+        Vädret är fint i dag, så vi åker ut till sjön efter lunch. Hon
+        läste en bok om hur man bygger ett hus av trä. Tåget går klockan åtta.
+        """),
+    'dutch': (('iso-8859-1', 'windows-1252', 'utf-8'), """
+        Wij gaan morgen met de fiets naar het strand, als het niet regent.
+        De coördinatie van het project was een heel gedoe, maar het
+        resultaat is goed. Hij heeft een café geopend in het centrum.
+        """),
+    'bulgarian': (('windows-1251', 'koi8-r', 'utf-8'), """
+        Времето днес е слънчево и топло, затова ще излезем на разходка.
+        Моля, изпратете ми документите до петък. Децата играят в двора
+        на училището. София е столицата на България.
+        """),
+    'russian': (('windows-1251', 'koi8-r', 'utf-8'), """
+        Поезд отправляется с третьего пути через пятнадцать минут.
+        Библиотека закрыта на ремонт до конца месяца. Мы купили свежий
+        хлеб, молоко и немного сыра. Зимой здесь бывает очень холодно.
+        """),
+    'ukrainian': (('windows-1251', 'utf-8'), """
+        Київ є столицею України і одним з найстаріших міст Європи.
+        Ми їздили до моря минулого літа, і це було чудово. Будь ласка,
+        зачекайте хвилинку, я зараз повернуся.
+        """),
+    }
+
+
+def random_corpus(documents=300, seed=0, texts=HELD_OUT_TEXTS):
+    """Return ``documents`` reproducible random documents made from the
+    sentences in ``texts`` (like ``TEXTS``), as a list of ``(encoding,
+    bytes)`` tuples, in all encodings given for their language, between
+    a sentence and some 20 KB long.
+
+    Western european texts without any of the windows-1252 characters
+    in 0x80-0x9f are labelled iso-8859-1.
+    """
+    rnd = random.Random(seed)
+    sentences = dict((language, [line.strip() for line in text.splitlines()
+                                 if line.strip()])
+                     for language, (encodings, text) in texts.items())
+    languages = sorted(texts)
+    corpus = []
+    for i in range(documents):
+        language = languages[i % len(languages)]
+        encoding = rnd.choice(texts[language][0])
+        count = int(rnd.expovariate(1 / 30.0)) + 1
+        text = ' '.join(rnd.choice(sentences[language]) for _ in range(count))
+        if encoding in ('iso-8859-1', 'windows-1252'):
+            try:
+                text.encode('iso-8859-1')
+                encoding = 'iso-8859-1'
+            except UnicodeEncodeError:
+                encoding = 'windows-1252'
+        corpus.append((encoding, text.encode(encoding)))
+    return corpus
+
+
+def _encoding(name):
+    """The encoding a corpus directory name starts with, e.g.
+    ``windows-1251`` for ``windows-1251-russian``, or ``None``.
+    """
+    parts = name.split('-')
+    for end in range(len(parts), 0, -1):
+        try:
+            return codecs.lookup('-'.join(parts[:end])).name
+        except LookupError:
+            pass
+    return None
+
+
+def read_corpus(path):
+    """Read the documents in the subdirectories of ``path`` whose names
+    start with the encoding of the documents inside, like
+    ``windows-1251-russian``, as a list of ``(encoding, bytes)`` tuples.
+    """
+    corpus = []
+    for name in sorted(os.listdir(path)):
+        encoding = _encoding(name)
+        directory = os.path.join(path, name)
+        if encoding is None or not os.path.isdir(directory):
+            continue
+        for root, dirs, files in os.walk(directory):
+            for filename in sorted(files):
+                with open(os.path.join(root, filename), 'rb') as f:
+                    corpus.append((encoding, f.read()))
+    return corpus
+
+
+def _correct(data, expected, found):
+    """Whether decoding ``data`` as ``found`` gives the same text as
+    decoding it as ``expected`` (e.g. any ASCII compatible encoding for
+    an ASCII text).
+    """
+    try:
+        return found is not None and \
+            data.decode(found) == data.decode(expected)
+    except (LookupError, UnicodeDecodeError):
+        return False
+
+
+def _reference_guess_content_by_mediatype(media_type):
+    """The implementation of ``guess_content_by_mediatype()`` before the
+    classification tables were precompiled, to measure against.
+    """
+    if not media_type:
+        return ContentTypes.Unknown;
+
+    xml_application_types = [
+        r'application/.*?\+xml',
+        'application/xml',
+        'application/xml-dtd',
+        'application/xml-external-parsed-entity']
+    xml_text_types = [
+        r'text\/.*?\+xml',
+        'text/xml',
+        'text/xml-external-parsed-entity']
+
+    media_type = media_type.strip().lower()
+
+    if media_type in xml_application_types or\
+            re.match(xml_application_types[0], media_type, re.I|re.S|re.X):
+        xmltype = ContentTypes.XMLApplication
+    elif media_type in xml_text_types or\
+            re.match(xml_text_types[0], media_type, re.I|re.S|re.X):
+        xmltype = ContentTypes.XMLText
+    elif media_type == 'text/html':
+        xmltype = ContentTypes.HTMLText
+    elif media_type.startswith('text/'):
+        xmltype = ContentTypes.Text
+    else:
+        xmltype = ContentTypes.Unknown
+
+    return xmltype
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def benchmark_media_types(calls=200000):
+    """Measure the cost per call of ``guess_content_by_mediatype()``
+    (against its former implementation, and with a ``DetectionCache``),
+    of ``default_for_media_type()``, and of ``detect()`` given only a
+    Content-Type header, over ``calls`` values from ``MEDIA_TYPES``.
+    """
+    media_types = (MEDIA_TYPES * (calls // len(MEDIA_TYPES) + 1))[:calls]
+    # Header values as find_in_content_type() hands them on.
+    bare = [m.split(';')[0].strip().lower() for m in media_types]
+    results = []
+
+    elapsed, expected = _timed(lambda: [
+        _reference_guess_content_by_mediatype(m) for m in bare])
+    results.append(('former guess_content_by_mediatype (us/call)',
+                    elapsed / calls * 1e6))
+    elapsed, found = _timed(lambda: [guess_content_by_mediatype(m)
+                                     for m in bare])
+    results.append(('guess_content_by_mediatype (us/call)',
+                    elapsed / calls * 1e6))
+    results.append(('guess_content_by_mediatype mismatches',
+                    sum(1 for f, e in zip(found, expected) if f != e)))
+
+    cache = DetectionCache()
+    elapsed, _ = _timed(lambda: [guess_content_by_mediatype(m, cache)
+                                 for m in bare])
+    results.append(('cached guess_content_by_mediatype (us/call)',
+                    elapsed / calls * 1e6))
+
+    elapsed, _ = _timed(lambda: [default_for_media_type(m) for m in bare])
+    results.append(('default_for_media_type (us/call)', elapsed / calls * 1e6))
+
+    elapsed, _ = _timed(lambda: [detect(b'', content_type=m)
+                                 for m in media_types])
+    results.append(('detect, Content-Type only (us/call)',
+                    elapsed / calls * 1e6))
+    return results
+
+
+def benchmark_cache(calls=20000, repeat=3):
+    """Measure the cost per call of ``detect()`` for the ``DOCUMENTS``:
+    without a cache, on a cache miss, and on a cache hit (the best of
+    ``repeat`` runs each).
+    """
+    results = []
+    for name, content, content_type in DOCUMENTS:
+        cache = DetectionCache()
+
+        def miss():
+            cache.clear()
+            return detect(content, content_type=content_type, cache=cache)
+
+        for label, func in (
+                ('uncached', lambda: detect(content, content_type=content_type)),
+                ('cache miss', miss),
+                ('cache hit', lambda: detect(content, content_type=content_type,
+                                             cache=cache))):
+            elapsed = min(_timed(lambda: [func() for i in range(calls)])[0]
+                          for i in range(repeat))
+            results.append(('detect %s, %s (us/call)' % (name, label),
+                            elapsed / calls * 1e6))
+    return results
+
+
+def benchmark_guess(corpus=None, sample_size=None):
+    """Measure accuracy and throughput of ``guess_bytes()`` and, if
+    installed, ``chardet.detect()`` on the documents of the directory
+    ``corpus`` (see ``read_corpus()``), or on ``random_corpus()`` of
+    the ``HELD_OUT_TEXTS``.
+
+    Both are given all of each document, unless ``sample_size`` is set.
+    A guess counts as correct if it decodes a document to the same text
+    as its actual encoding.
+    """
+    if corpus is None:
+        documents = random_corpus()
+    else:
+        documents = read_corpus(corpus)
+    if sample_size is not None:
+        documents = [(e, d[:sample_size]) for e, d in documents]
+    size = sum(len(d) for e, d in documents)
+    detectors = [('guess_bytes', guess_bytes)]
+    try:
+        import chardet
+    except ImportError:
+        pass
+    else:
+        detectors.append(('chardet', lambda d: chardet.detect(d)['encoding']))
+
+    results = [('documents', len(documents)), ('MB', size / 1e6)]
+    for name, detector in detectors:
+        elapsed, found = _timed(lambda: [detector(d) for e, d in documents])
+        correct = sum(1 for (e, d), f in zip(documents, found)
+                      if _correct(d, e, f))
+        results.append(('%s accuracy (%%)' % name,
+                        100.0 * correct / max(len(documents), 1)))
+        results.append(('%s MB/s' % name, size / 1e6 / elapsed))
+    return results
+
+
+def run(out=sys.stdout, corpus=None):
+    """Run all benchmarks and write a report to ``out``. ``corpus`` is
+    passed on to ``benchmark_guess()``.
+    """
+    for name, benchmark in (('Media types', benchmark_media_types),
+                            ('Detection cache', benchmark_cache),
+                            ('Encoding guessing',
+                             lambda: benchmark_guess(corpus))):
+        out.write('%s\n%s\n' % (name, '-' * len(name)))
+        for label, value in benchmark():
+            out.write('    %-45s %12.6g\n' % (label, value))
+        out.write('\n')
+
+
+if __name__ == '__main__':
+    run(corpus=sys.argv[1] if len(sys.argv) > 1 else None)
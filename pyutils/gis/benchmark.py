@@ -0,0 +1,410 @@
+"""Benchmarks for the ``pyutils.gis`` modules.
+
+Run as a script to execute all benchmarks:
+
+    python -m pyutils.gis.benchmark
+
+Each benchmark is also available as a function that returns its
+results as a list of ``(name, value)`` tuples, in case they should be
+recorded somewhere.
+
+Requires NumPy. The accuracy of the spherical formulas is measured
+against a reference computed with mpmath, if it is installed.
+"""
+
+import math
+import sys
+import time
+
+import numpy
+
+from . import geodesy
+from .geodesy import EARTH_RADIUS, GeoPoint, distance_haversine, \
+     distance_haversine_array, distance_vincenty, within_distance
+
+
+__all__ = ('CASES', 'random_points', 'random_pairs', 'benchmark_index',
+           'benchmark_line_index', 'benchmark_ellipsoidal', 'benchmark_geopoint',
+           'benchmark_geodesy', 'run',)
+
+
+# The kinds of coordinate sets ``random_pairs()`` can generate.
+CASES = ('uniform', 'short', 'antipodal', 'near-pole')
+
+
+def random_points(n, seed=0):
+    """Return ``n`` reproducible random points, uniformly distributed
+    over the sphere, as a 2-tuple of arrays (lats, lons) in degrees.
+    """
+    rnd = numpy.random.RandomState(seed)
+    lats = numpy.degrees(numpy.arcsin(rnd.uniform(-1, 1, n)))
+    lons = rnd.uniform(-180, 180, n)
+    return lats, lons
+
+
+def random_pairs(n, case='uniform', seed=0):
+    """Return ``n`` reproducible random pairs of points as a 4-tuple of
+    arrays (lats1, lons1, lats2, lons2), in degrees. ``case`` is one of
+    ``CASES``:
+
+    ``uniform``
+        Both points uniformly distributed over the sphere.
+    ``short``
+        The second point is within about 1km of the first one.
+    ``antipodal``
+        The second point is within about 10m of the antipode of the
+        first one.
+    ``near-pole``
+        Both points are within about 10km of the same pole; some are
+        exactly on it.
+
+    >>> lats1, lons1, lats2, lons2 = random_pairs(3, 'antipodal')
+    >>> numpy.allclose(lats1, -lats2, atol=1e-3)
+    True
+    """
+    if case not in CASES:
+        raise ValueError('unknown case: %r' % (case,))
+    rnd = numpy.random.RandomState(seed)
+    lats1, lons1 = random_points(n, seed=seed + 1)
+    if case == 'uniform':
+        lats2, lons2 = random_points(n, seed=seed + 2)
+    elif case == 'near-pole':
+        sign = numpy.where(rnd.uniform(size=n) < 0.5, -1, 1)
+        lats1 = sign * (90 - rnd.uniform(0, 0.1, n))
+        lats2 = sign * (90 - rnd.uniform(0, 0.1, n))
+        lats1[::100] = sign[::100] * 90
+        lons2 = rnd.uniform(-180, 180, n)
+    else:
+        offset = 0.01 if case == 'short' else 0.0001
+        lats2, lons2 = lats1, lons1
+        if case == 'antipodal':
+            lats2, lons2 = -lats1, lons1 + 180
+        lats2 = numpy.clip(lats2 + rnd.uniform(-offset, offset, n), -90, 90)
+        lons2 = (lons2 + rnd.uniform(-offset, offset, n) + 180) % 360 - 180
+    return lats1, lons1, lats2, lons2
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def benchmark_index(points=200000, queries=200, k=5, radius=100):
+    """Compare ``PointIndex`` against brute-force haversine searches.
+
+    The scalar brute force (calling ``distance_haversine`` for every
+    candidate) is only timed for a few queries and extrapolated.
+    """
+    from .index import PointIndex
+
+    lats, lons = random_points(points)
+    qlats, qlons = random_points(queries, seed=1)
+    results = []
+
+    build, index = _timed(PointIndex, lats, lons)
+    results.append(('index build (s)', build))
+
+    elapsed, found = _timed(lambda: [index.nearest(a, b, k)
+                                     for a, b in zip(qlats, qlons)])
+    results.append(('index k-nearest queries/s', queries / elapsed))
+
+    def brute_array(a, b):
+        d = distance_haversine_array(a, b, lats, lons)
+        return numpy.argsort(d)[:k]
+    elapsed, expected = _timed(lambda: [brute_array(a, b)
+                                        for a, b in zip(qlats, qlons)])
+    results.append(('array brute force k-nearest queries/s', queries / elapsed))
+
+    scalar_queries = min(queries, 3)
+    elapsed, _ = _timed(lambda: [
+        min((distance_haversine(a, b, c, d), i)
+            for i, (c, d) in enumerate(zip(lats.tolist(), lons.tolist())))
+        for a, b in zip(qlats[:scalar_queries], qlons[:scalar_queries])])
+    results.append(('scalar brute force nearest queries/s',
+                    scalar_queries / elapsed))
+
+    mismatches = sum(1 for f, e in zip(found, expected)
+                     if [i for _, i in f] != e.tolist())
+    results.append(('k-nearest mismatches vs brute force', mismatches))
+
+    elapsed, _ = _timed(lambda: [index.within(a, b, radius)
+                                 for a, b in zip(qlats, qlons)])
+    results.append(('index within-%skm queries/s' % radius, queries / elapsed))
+
+    return results
+
+
+def benchmark_line_index(segments=5000, points=2000, repeat=3):
+    """Compare snapping ``points`` onto a line of ``segments`` segments
+    with ``LineIndex.snap()`` against a ``locate_point()`` call per
+    point (the best of ``repeat`` runs).
+    """
+    from .planar import LineIndex, locate_point
+
+    x = numpy.linspace(0, 50, segments + 1)
+    line = numpy.column_stack((x, numpy.sin(x)))
+    rnd = numpy.random.RandomState(0)
+    queries = numpy.column_stack((rnd.uniform(0, 50, points),
+                                  rnd.uniform(-2, 2, points)))
+    results = []
+
+    build, index = _timed(LineIndex, line)
+    results.append(('index build (s)', build))
+    results.append(('index snap (s)', min(_timed(index.snap, queries)[0]
+                                          for i in range(repeat))))
+    brute_force = lambda: [locate_point(line, p) for p in queries]
+    results.append(('brute force locate_point (s)',
+                    min(_timed(brute_force)[0] for i in range(repeat))))
+    found, expected = index.snap(queries)[0], brute_force()
+    results.append(('mismatches vs brute force',
+                    int((abs(found - expected) > 1e-9).any(axis=1).sum())))
+    return results
+
+
+def benchmark_geopoint(calls=300000, repeat=3):
+    """Measure the time for ``calls`` queries of ``distance_haversine``,
+    ``bearing`` and ``cross_track`` from a fixed origin, with the scalar
+    functions and with the methods of a ``GeoPoint`` for the origin
+    (the best of ``repeat`` runs).
+    """
+    lat, lon = 48.76165, 11.41947
+    point = GeoPoint(lat, lon)
+    lats, lons = random_points(calls)
+    lats, lons = lats.tolist(), lons.tolist()
+    points = list(zip(lats, lons))
+    # Paths from the origin, and the points to measure against them.
+    paths = list(zip(lats, lons, lats[1:] + lats[:1], lons[1:] + lons[:1]))
+
+    tests = (
+        ('distance_haversine',
+         lambda: [distance_haversine(lat, lon, a, b) for a, b in points],
+         lambda: [point.distance_haversine(a, b) for a, b in points]),
+        ('bearing',
+         lambda: [geodesy.bearing(lat, lon, a, b) for a, b in points],
+         lambda: [point.bearing(a, b) for a, b in points]),
+        ('cross_track',
+         lambda: [geodesy.cross_track(lat, lon, a, b, c, d) for a, b, c, d in paths],
+         lambda: [point.cross_track(a, b, c, d) for a, b, c, d in paths]),
+    )
+    results = []
+    for name, function, method in tests:
+        results.append(('%s function (s)' % name,
+                        min(_timed(function)[0] for i in range(repeat))))
+        results.append(('%s GeoPoint method (s)' % name,
+                        min(_timed(method)[0] for i in range(repeat))))
+    return results
+
+
+def benchmark_ellipsoidal(points=100000, radius=500, scalar_calls=20000):
+    """Compare the throughput of ``distance_vincenty`` against the
+    spherical formulas, and of the tiered ``within_distance`` against
+    running Vincenty on every point.
+
+    The points are scaled into a region around (0, 0), as Vincenty
+    may not converge for nearly antipodal pairs.
+    """
+    lats, lons = random_points(points)
+    lats, lons = lats / 10, lons / 10
+    a, b = lats.tolist(), lons.tolist()
+    pairs = list(zip(a[:scalar_calls], b[:scalar_calls],
+                     a[1:scalar_calls + 1], b[1:scalar_calls + 1]))
+    results = []
+
+    elapsed, _ = _timed(lambda: [distance_haversine(*p) for p in pairs])
+    results.append(('scalar haversine calls/s', len(pairs) / elapsed))
+    elapsed, _ = _timed(lambda: [distance_vincenty(*p) for p in pairs])
+    results.append(('scalar vincenty calls/s', len(pairs) / elapsed))
+    elapsed, _ = _timed(distance_haversine_array, lats[:-1], lons[:-1],
+                        lats[1:], lons[1:])
+    results.append(('array haversine distances/s', (points - 1) / elapsed))
+
+    elapsed, tiered = _timed(within_distance, 0, 0, lats, lons, radius)
+    results.append(('tiered within_distance points/s', points / elapsed))
+    sample = min(points, scalar_calls)
+    elapsed, exact = _timed(lambda: [distance_vincenty(0, 0, p, q) <= radius
+                                     for p, q in zip(a[:sample], b[:sample])])
+    results.append(('vincenty-only within_distance points/s', sample / elapsed))
+    results.append(('tiered mismatches vs vincenty-only',
+                    int(numpy.sum(tiered[:sample] != exact))))
+    return results
+
+
+class _Reference(object):
+    """Reference versions of the spherical formulas, which work with 3D
+    vectors, and are well-conditioned for all inputs (unlike e.g. the
+    law of cosines for short distances, or the haversine formula for
+    nearly antipodal points).
+
+    With mpmath, they are evaluated with 40 significant digits,
+    otherwise with floats, which is still some orders of magnitude
+    more accurate than the formulas being measured.
+    """
+
+    def __init__(self):
+        try:
+            import mpmath
+        except ImportError:
+            self.name, self.m, self.one = 'floats', math, 1.0
+        else:
+            self.name, self.m = 'mpmath', mpmath.MPContext()
+            self.m.dps = 40
+            self.one = self.m.mpf(1)
+
+    def _frame(self, lat, lon):
+        """The unit vector of a point, and the vectors pointing north
+        and east from it.
+        """
+        m = self.m
+        phi, lam = m.radians(lat), m.radians(lon)
+        sin_phi, cos_phi = m.sin(phi), m.cos(phi)
+        sin_lam, cos_lam = m.sin(lam), m.cos(lam)
+        return ((cos_phi * cos_lam, cos_phi * sin_lam, sin_phi),
+                (-sin_phi * cos_lam, -sin_phi * sin_lam, cos_phi),
+                (-sin_lam, cos_lam, 0))
+
+    def _angle(self, a, b):
+        cross = _cross(a, b)
+        return self.m.atan2(self.m.sqrt(_dot(cross, cross)), _dot(a, b))
+
+    def distance(self, lat1, lon1, lat2, lon2):
+        a = self._frame(lat1, lon1)[0]
+        b = self._frame(lat2, lon2)[0]
+        return float(self._angle(a, b) * EARTH_RADIUS)
+
+    def bearing(self, lat1, lon1, lat2, lon2):
+        a, north, east = self._frame(lat1, lon1)
+        b = self._frame(lat2, lon2)[0]
+        return float(self.m.atan2(_dot(b, east), _dot(b, north)))
+
+    def destination(self, lat, lon, bearing, d):
+        m = self.m
+        a, north, east = self._frame(lat, lon)
+        delta, theta = self.one * d / EARTH_RADIUS, m.radians(bearing)
+        v = [m.cos(delta) * p + m.sin(delta) * (m.cos(theta) * q + m.sin(theta) * r)
+             for p, q, r in zip(a, north, east)]
+        return (float(m.degrees(m.atan2(v[2], m.sqrt(v[0] ** 2 + v[1] ** 2)))),
+                float(m.degrees(m.atan2(v[1], v[0]))))
+
+    def cross_track(self, latA, lonA, latB, lonB, latP, lonP):
+        m = self.m
+        a, b, p = [self._frame(lat, lon)[0] for lat, lon in
+                   ((latA, lonA), (latB, lonB), (latP, lonP))]
+        normal = _cross(a, b)
+        s = _dot(p, normal) / m.sqrt(_dot(normal, normal))
+        # Positive to the right of the path, as in ``cross_track()``.
+        return float(-m.atan2(s, m.sqrt(max(1 - s * s, 0))) * EARTH_RADIUS)
+
+
+def _dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def _cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2],
+            a[0] * b[1] - a[1] * b[0])
+
+
+def _scalar_calls(func, args):
+    """Call ``func`` for every tuple in ``args``; returns the results,
+    with ``None`` for the calls that failed with a ``ValueError``
+    (like math domain errors), and the number of failed calls.
+    """
+    results, failed = [], 0
+    for a in args:
+        try:
+            results.append(func(*a))
+        except ValueError:
+            results.append(None)
+            failed += 1
+    return results, failed
+
+
+def benchmark_geodesy(points=100000, scalar_calls=20000, reference_points=500,
+                      cases=CASES):
+    """Measure speed and accuracy of ``distance_haversine``,
+    ``distance_cosine``, ``bearing``, ``destination`` and
+    ``cross_track``, for the scalar functions and their ``*_array``
+    versions, over the coordinate sets of ``random_pairs()``.
+
+    The errors are the maximum absolute differences from the results
+    of ``_Reference`` for the first ``reference_points`` inputs: in km,
+    or in degrees for bearings; for destinations, the distance from the
+    reference point. Scalar calls that fail (e.g. with a math domain
+    error) are counted, and left out of the errors.
+    """
+    reference = _Reference()
+
+    def distance_error(result, expected):
+        return abs(result - expected)
+
+    def bearing_error(result, expected):
+        return math.degrees(abs((result - expected + math.pi) % (2 * math.pi) - math.pi))
+
+    def destination_error(result, expected):
+        return reference.distance(result[0], result[1], *expected)
+
+    results = []
+    for case in cases:
+        lats1, lons1, lats2, lons2 = random_pairs(points, case)
+        latsP, lonsP = random_pairs(points, case, seed=1)[2:]
+        bearings = numpy.random.RandomState(2).uniform(0, 360, points)
+        distances = distance_haversine_array(lats1, lons1, lats2, lons2)
+        lat1, lon1, lat2, lon2, latP, lonP, bearing, distance = [
+            v[:scalar_calls].tolist() for v in (lats1, lons1, lats2, lons2,
+                                                latsP, lonsP, bearings, distances)]
+        pairs = list(zip(lat1, lon1, lat2, lon2))
+
+        tests = (
+            ('distance_haversine', pairs, reference.distance, distance_error,
+             lambda: geodesy.distance_haversine_array(lats1, lons1, lats2, lons2)),
+            ('distance_cosine', pairs, reference.distance, distance_error,
+             lambda: geodesy.distance_cosine_array(lats1, lons1, lats2, lons2)),
+            ('bearing', pairs, reference.bearing, bearing_error,
+             lambda: geodesy.bearing_array(lats1, lons1, lats2, lons2)),
+            ('destination', list(zip(lat1, lon1, bearing, distance)),
+             reference.destination, destination_error,
+             lambda: numpy.transpose(geodesy.destination_array(
+                 lats1, lons1, bearings, distances))),
+            ('cross_track', list(zip(lat1, lon1, lat2, lon2, latP, lonP)),
+             reference.cross_track, distance_error,
+             lambda: geodesy.cross_track_array(lats1, lons1, lats2, lons2,
+                                               latsP, lonsP)),
+        )
+        for name, args, reference_func, error, array_func in tests:
+            label = '%s %s' % (name, case)
+            elapsed, (scalar, failed) = _timed(_scalar_calls,
+                                               getattr(geodesy, name), args)
+            results.append(('%s scalar calls/s' % label, len(args) / elapsed))
+            elapsed, array = _timed(array_func)
+            results.append(('%s array calls/s' % label, points / elapsed))
+
+            expected = [reference_func(*a) for a in args[:reference_points]]
+            errors = [error(r, e) for r, e in zip(scalar, expected) if r is not None]
+            results.append(('%s scalar max error' % label,
+                            max(errors) if errors else float('nan')))
+            errors = [error(r, e) for r, e in zip(array.tolist(), expected)]
+            results.append(('%s array max error' % label, max(errors)))
+            if failed:
+                results.append(('%s scalar failed calls' % label, failed))
+    results.append(('errors measured with mpmath (1 = yes)',
+                    int(reference.name == 'mpmath')))
+    return results
+
+
+def run(out=sys.stdout):
+    """Run all benchmarks and write a report to ``out``.
+    """
+    for name, benchmark in (('PointIndex', benchmark_index),
+                            ('LineIndex', benchmark_line_index),
+                            ('Ellipsoidal distances', benchmark_ellipsoidal),
+                            ('GeoPoint', benchmark_geopoint),
+                            ('Spherical geodesy', benchmark_geodesy)):
+        out.write('%s\n%s\n' % (name, '-' * len(name)))
+        for label, value in benchmark():
+            out.write('    %-45s %12.6g\n' % (label, value))
+        out.write('\n')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,430 @@
+"""Spatial cell keys: geohashes and quadkeys.
+
+Both schemes divide the world into a hierarchy of rectangular cells and
+name every cell with a string key, such that the key of a cell is a
+prefix of the keys of all cells inside it. This makes them useful as
+bucket keys for sharding and caching, and for answering range queries
+with prefix lookups in key-value stores.
+
+Geohashes divide the lat/lon plane (see http://geohash.org/), quadkeys
+the Web Mercator tiles used by Bing Maps and others (see
+http://msdn.microsoft.com/en-us/library/bb259689.aspx).
+
+Internally a cell is a pair of integer column and row numbers, whose
+bits are interleaved to get the key. The ``*_array`` functions require
+NumPy, everything else works without it.
+"""
+
+from math import radians, degrees, sin, tan, atan, sinh, log, acos, pi
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .geodesy import EARTH_RADIUS, destination
+
+
+__all__ = ('geohash_encode', 'geohash_decode', 'geohash_bounds',
+           'geohash_neighbours', 'geohash_cover', 'geohash_encode_array',
+           'quadkey_encode', 'quadkey_decode', 'quadkey_bounds',
+           'quadkey_neighbours', 'quadkey_cover', 'quadkey_encode_array',)
+
+
+GEOHASH_MAX_PRECISION = 12
+QUADKEY_MAX_LEVEL = 31
+
+# The latitude range of Web Mercator, which makes the map a square.
+MERCATOR_MAX_LAT = 85.05112878
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_BASE32_INDEX = dict((c, i) for i, c in enumerate(_BASE32))
+
+# The eight neighbours of a cell, as (column, row) offsets with rows
+# counted northwards, clockwise starting at north.
+_DIRECTIONS = ((0, 1), (1, 1), (1, 0), (1, -1),
+               (0, -1), (-1, -1), (-1, 0), (-1, 1))
+
+
+def _spread(v):
+    """Move the lower 32 bits of ``v`` to the even bit positions. Works
+    for Python integers and NumPy ``uint64`` arrays alike.
+    """
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    return (v | (v << 1)) & 0x5555555555555555
+
+
+def _compact(v):
+    """The inverse of ``_spread()``.
+    """
+    v = v & 0x5555555555555555
+    v = (v | (v >> 1)) & 0x3333333333333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF00FF00FF
+    v = (v | (v >> 8)) & 0x0000FFFF0000FFFF
+    return (v | (v >> 16)) & 0x00000000FFFFFFFF
+
+
+def _quantize(value, low, high, bits):
+    """The number of the cell ``value`` falls into, when dividing the
+    range ``low..high`` into ``2**bits`` cells.
+    """
+    n = 1 << bits
+    i = int((value - low) / (high - low) * n)
+    return min(max(i, 0), n - 1)
+
+
+def _quantize_array(values, low, high, bits):
+    n = 1 << bits
+    cells = numpy.floor((values - low) / (high - low) * n)
+    return numpy.clip(cells, 0, n - 1).astype(numpy.uint64)
+
+
+def _lon_columns(west, east, bits):
+    """The cell columns between two longitudes, with ``west > east``
+    if the range crosses the antimeridian.
+    """
+    n = 1 << bits
+    if west is None:
+        return list(range(n))
+    first, last = _quantize(west, -180, 180, bits), _quantize(east, -180, 180, bits)
+    if west <= east:
+        return list(range(first, last + 1))
+    return list(range(first, n)) + list(range(0, last + 1))
+
+
+def _radius_bounds(lat, lon, radius):
+    """The bounding box of all points within ``radius`` km of the given
+    location, as a 4-tuple (south, west, north, east). ``west`` and
+    ``east`` are ``None`` if the circle includes a pole, and ``west`` is
+    larger than ``east`` if it crosses the antimeridian.
+    """
+    delta = radius / EARTH_RADIUS
+    phi = radians(lat)
+    north = destination(lat, lon, 0, radius)[0] \
+        if phi + delta < pi / 2 else 90.0
+    south = destination(lat, lon, 180, radius)[0] \
+        if phi - delta > -pi / 2 else -90.0
+    if north == 90.0 or south == -90.0:
+        return south, None, north, None
+    # The points with the largest longitude difference are where the
+    # meridians touch the circle, at this bearing.
+    bearing = degrees(acos(tan(delta) * tan(phi)))
+    east = destination(lat, lon, bearing, radius)[1]
+    west = destination(lat, lon, -bearing, radius)[1]
+    return south, west, north, east
+
+
+def _unique(keys, exclude):
+    seen = set([exclude])
+    return [k for k in keys if not (k in seen or seen.add(k))]
+
+
+# Geohashes
+
+def _geohash_bits(precision):
+    """The number of bits for the longitude and latitude of a geohash
+    of the given length.
+    """
+    if not 1 <= precision <= GEOHASH_MAX_PRECISION:
+        raise ValueError('precision must be between 1 and %d' %
+                         GEOHASH_MAX_PRECISION)
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2
+
+
+def _geohash_interleave(x, y, precision):
+    # The first bit is a longitude bit, so the longitude goes to the
+    # odd positions if the number of bits is even.
+    if precision % 2:
+        return _spread(x) | (_spread(y) << 1)
+    return (_spread(x) << 1) | _spread(y)
+
+
+def _geohash_key(x, y, precision):
+    code = _geohash_interleave(x, y, precision)
+    return ''.join([_BASE32[(code >> 5 * i) & 31]
+                    for i in range(precision - 1, -1, -1)])
+
+
+def _geohash_cell(geohash):
+    """Return the column and row of a geohash, and its precision.
+    """
+    precision = len(geohash)
+    _geohash_bits(precision)
+    code = 0
+    try:
+        for c in geohash.lower():
+            code = (code << 5) | _BASE32_INDEX[c]
+    except KeyError:
+        raise ValueError('invalid geohash: %r' % (geohash,))
+    if precision % 2:
+        return _compact(code), _compact(code >> 1), precision
+    return _compact(code >> 1), _compact(code), precision
+
+
+def geohash_encode(lat, lon, precision=9):
+    """Return the geohash of the given location, with ``precision``
+    characters (up to 12).
+
+    >>> geohash_encode(57.64911, 10.40744, 11)
+    'u4pruydqqvj'
+    >>> geohash_encode(48.76165, 11.41947, 5)
+    'u28j7'
+    """
+    xbits, ybits = _geohash_bits(precision)
+    return _geohash_key(_quantize(lon, -180, 180, xbits),
+                        _quantize(lat, -90, 90, ybits), precision)
+
+
+def geohash_bounds(geohash):
+    """Return the cell of a geohash as a 4-tuple (south, west, north,
+    east), in degrees.
+
+    >>> geohash_bounds('u28j7')
+    (48.7353515625, 11.3818359375, 48.779296875, 11.42578125)
+    """
+    x, y, precision = _geohash_cell(geohash)
+    xbits, ybits = _geohash_bits(precision)
+    width, height = 360.0 / (1 << xbits), 180.0 / (1 << ybits)
+    return (y * height - 90, x * width - 180,
+            (y + 1) * height - 90, (x + 1) * width - 180)
+
+
+def geohash_decode(geohash):
+    """Return the center of the cell of a geohash as a 2-tuple (lat,
+    lon), in degrees.
+
+    >>> "%.5f, %.5f" % geohash_decode('u4pruydqqvj')
+    '57.64911, 10.40744'
+    """
+    south, west, north, east = geohash_bounds(geohash)
+    return (south + north) / 2, (west + east) / 2
+
+
+def geohash_neighbours(geohash):
+    """Return the geohashes of the (up to eight) cells adjacent to the
+    given one, clockwise starting at north. Cells beyond the poles are
+    left out; at the antimeridian, the cells on the other side count as
+    neighbours.
+
+    >>> geohash_neighbours('u28j7')
+    ['u28je', 'u28js', 'u28jk', 'u28jh', 'u28j5', 'u28j4', 'u28j6', 'u28jd']
+    >>> geohash_neighbours('b')
+    ['c', '9', '8', 'x', 'z']
+    """
+    x, y, precision = _geohash_cell(geohash)
+    xbits, ybits = _geohash_bits(precision)
+    columns, rows = 1 << xbits, 1 << ybits
+    return _unique([_geohash_key((x + dx) % columns, y + dy, precision)
+                    for dx, dy in _DIRECTIONS if 0 <= y + dy < rows],
+                   geohash.lower())
+
+
+def _geohash_cover_cells(bounds, precision):
+    south, west, north, east = bounds
+    xbits, ybits = _geohash_bits(precision)
+    columns = _lon_columns(west, east, xbits)
+    rows = range(_quantize(south, -90, 90, ybits),
+                 _quantize(north, -90, 90, ybits) + 1)
+    return columns, rows
+
+
+def geohash_cover(lat, lon, radius, precision=None, max_cells=16):
+    """Return a sorted list of geohashes whose cells together cover
+    all points within ``radius`` km of the given location.
+
+    If ``precision`` is not given, the finest precision for which no
+    more than ``max_cells`` geohashes are needed is used.
+
+    >>> geohash_cover(48.76165, 11.41947, 2)
+    ['u28j7', 'u28je', 'u28jk', 'u28js']
+    >>> len(geohash_cover(48.76165, 11.41947, 2, 6))
+    48
+    """
+    bounds = _radius_bounds(lat, lon, radius)
+    if precision is None:
+        precision = 1
+        while precision < GEOHASH_MAX_PRECISION:
+            columns, rows = _geohash_cover_cells(bounds, precision + 1)
+            if len(columns) * len(rows) > max_cells:
+                break
+            precision += 1
+    columns, rows = _geohash_cover_cells(bounds, precision)
+    return sorted(_geohash_key(x, y, precision) for x in columns for y in rows)
+
+
+def geohash_encode_array(lats, lons, precision=9):
+    """Vectorized version of ``geohash_encode()``: return the geohashes
+    of all given locations as a NumPy array of strings.
+
+    >>> geohash_encode_array([57.64911, 48.76165], [10.40744, 11.41947], 5).tolist()
+    ['u4pru', 'u28j7']
+    """
+    xbits, ybits = _geohash_bits(precision)
+    lats = numpy.asarray(lats, dtype=numpy.float64).ravel()
+    lons = numpy.asarray(lons, dtype=numpy.float64).ravel()
+    x = _quantize_array(lons, -180, 180, xbits)
+    y = _quantize_array(lats, -90, 90, ybits)
+    code = _geohash_interleave(x, y, precision)
+    alphabet = numpy.frombuffer(_BASE32.encode('ascii'), dtype=numpy.uint8)
+    chars = numpy.empty((len(code), precision), dtype=numpy.uint8)
+    for i in range(precision):
+        shift = numpy.uint64(5 * (precision - 1 - i))
+        chars[:, i] = alphabet[(code >> shift) & numpy.uint64(31)]
+    return chars.view('S%d' % precision).ravel().astype('U%d' % precision)
+
+
+
+# Quadkeys
+
+def _check_level(level):
+    if not 1 <= level <= QUADKEY_MAX_LEVEL:
+        raise ValueError('level must be between 1 and %d' % QUADKEY_MAX_LEVEL)
+
+
+def _mercator_row(lat, level):
+    """The tile row (counted southwards) of a latitude.
+    """
+    lat = min(max(lat, -MERCATOR_MAX_LAT), MERCATOR_MAX_LAT)
+    s = sin(radians(lat))
+    y = 0.5 - log((1 + s) / (1 - s)) / (4 * pi)
+    return _quantize(y, 0, 1, level)
+
+
+def _mercator_lat(row, level):
+    """The latitude of the northern edge of a tile row.
+    """
+    return degrees(atan(sinh(pi * (1 - 2.0 * row / (1 << level)))))
+
+
+def _quadkey_key(x, y, level):
+    code = (_spread(y) << 1) | _spread(x)
+    return ''.join([str((code >> 2 * i) & 3) for i in range(level - 1, -1, -1)])
+
+
+def _quadkey_cell(quadkey):
+    """Return the column and row of a quadkey, and its level.
+    """
+    level = len(quadkey)
+    _check_level(level)
+    try:
+        code = int(quadkey, 4)
+    except ValueError:
+        raise ValueError('invalid quadkey: %r' % (quadkey,))
+    return _compact(code), _compact(code >> 1), level
+
+
+def quadkey_encode(lat, lon, level=16):
+    """Return the quadkey of the tile at ``level`` (up to 31) containing
+    the given location. Latitudes beyond the range of Web Mercator
+    (about 85 degrees) are clipped.
+
+    >>> quadkey_encode(48.76165, 11.41947, 10)
+    '1202300000'
+    """
+    _check_level(level)
+    return _quadkey_key(_quantize(lon, -180, 180, level),
+                        _mercator_row(lat, level), level)
+
+
+def quadkey_bounds(quadkey):
+    """Return the tile of a quadkey as a 4-tuple (south, west, north,
+    east), in degrees.
+
+    >>> "%.5f, %.5f, %.5f, %.5f" % quadkey_bounds('1202300000')
+    '48.69096, 11.25000, 48.92250, 11.60156'
+    """
+    x, y, level = _quadkey_cell(quadkey)
+    width = 360.0 / (1 << level)
+    return (_mercator_lat(y + 1, level), x * width - 180,
+            _mercator_lat(y, level), (x + 1) * width - 180)
+
+
+def quadkey_decode(quadkey):
+    """Return the center of a quadkey's tile (in Web Mercator) as a
+    2-tuple (lat, lon), in degrees.
+
+    >>> "%.5f, %.5f" % quadkey_decode('1202300000')
+    '48.80686, 11.42578'
+    """
+    x, y, level = _quadkey_cell(quadkey)
+    width = 360.0 / (1 << level)
+    return _mercator_lat(y + 0.5, level), (x + 0.5) * width - 180
+
+
+def quadkey_neighbours(quadkey):
+    """Return the quadkeys of the (up to eight) tiles adjacent to the
+    given one, clockwise starting at north, like
+    ``geohash_neighbours()``.
+
+    >>> quadkey_neighbours('12')
+    ['10', '11', '13', '31', '30', '21', '03', '01']
+    """
+    x, y, level = _quadkey_cell(quadkey)
+    n = 1 << level
+    return _unique([_quadkey_key((x + dx) % n, y - dy, level)
+                    for dx, dy in _DIRECTIONS if 0 <= y - dy < n],
+                   quadkey)
+
+
+def _quadkey_cover_cells(bounds, level):
+    south, west, north, east = bounds
+    columns = _lon_columns(west, east, level)
+    rows = range(_mercator_row(north, level), _mercator_row(south, level) + 1)
+    return columns, rows
+
+
+def quadkey_cover(lat, lon, radius, level=None, max_cells=16):
+    """Return a sorted list of quadkeys whose tiles together cover all
+    points within ``radius`` km of the given location (as far as they
+    are within the range of Web Mercator).
+
+    If ``level`` is not given, the finest level for which no more than
+    ``max_cells`` quadkeys are needed is used.
+
+    >>> quadkey_cover(48.76165, 11.41947, 2, max_cells=4)
+    ['120230000021', '120230000023', '120230000030', '120230000032']
+    >>> len(quadkey_cover(48.76165, 11.41947, 2, 14))
+    12
+    """
+    bounds = _radius_bounds(lat, lon, radius)
+    if level is None:
+        level = 1
+        while level < QUADKEY_MAX_LEVEL:
+            columns, rows = _quadkey_cover_cells(bounds, level + 1)
+            if len(columns) * len(rows) > max_cells:
+                break
+            level += 1
+    columns, rows = _quadkey_cover_cells(bounds, level)
+    return sorted(_quadkey_key(x, y, level) for x in columns for y in rows)
+
+
+def quadkey_encode_array(lats, lons, level=16):
+    """Vectorized version of ``quadkey_encode()``: return the quadkeys
+    of all given locations as a NumPy array of strings.
+
+    >>> quadkey_encode_array([48.76165, -33.9], [11.41947, 151.2], 4).tolist()
+    ['1202', '3112']
+    """
+    _check_level(level)
+    lats = numpy.clip(numpy.asarray(lats, dtype=numpy.float64).ravel(),
+                      -MERCATOR_MAX_LAT, MERCATOR_MAX_LAT)
+    lons = numpy.asarray(lons, dtype=numpy.float64).ravel()
+    s = numpy.sin(numpy.radians(lats))
+    x = _quantize_array(lons, -180, 180, level)
+    y = _quantize_array(0.5 - numpy.log((1 + s) / (1 - s)) / (4 * pi), 0, 1, level)
+    code = (_spread(y) << numpy.uint64(1)) | _spread(x)
+    chars = numpy.empty((len(code), level), dtype=numpy.uint8)
+    for i in range(level):
+        shift = numpy.uint64(2 * (level - 1 - i))
+        chars[:, i] = ((code >> shift) & numpy.uint64(3)).astype(numpy.uint8) + ord('0')
+    return chars.view('S%d' % level).ravel().astype('U%d' % level)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
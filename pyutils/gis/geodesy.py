@@ -22,16 +22,138 @@ I hope I won't need them again:
 """
 
 
-from math import radians, degrees, sin, cos, asin, sqrt, atan2, pi
+from math import radians, degrees, sin, cos, asin, acos, sqrt, atan2, pi
 
+try:
+    import numpy
+except ImportError:
+    # The ``*_array`` functions require NumPy, everything else works
+    # without it.
+    numpy = None
 
-__all__ = ('EARTH_RADIUS',
+try:
+    from geographiclib.geodesic import Geodesic
+except ImportError:
+    # Only needed by ``within_distance()``, for the nearly antipodal
+    # points Vincenty's formula cannot handle.
+    Geodesic = None
+
+
+__all__ = ('EARTH_RADIUS', 'GeoPoint',
            'distance_haversine', 'distance_cosine', 'bearing',
-           'bearing_degrees', 'destination', 'cross_track',)
+           'bearing_degrees', 'destination', 'cross_track',
+           'distance_haversine_array', 'distance_cosine_array',
+           'bearing_array', 'bearing_degrees_array', 'destination_array',
+           'cross_track_array', 'distance_matrix', 'iter_distance_matrix',
+           'cross_track_route', 'WGS84_A', 'WGS84_F', 'distance_vincenty',
+           'destination_vincenty', 'within_distance',)
 
 
 EARTH_RADIUS = R = 6371.0;   # kilometers  (make sure this is a float)
 
+# The WGS84 ellipsoid, used by the ``*_vincenty`` functions.
+WGS84_A = 6378.137              # semi-major axis, kilometers
+WGS84_F = 1 / 298.257223563     # flattening
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+# Maximum relative difference between a distance on the sphere (with
+# ``EARTH_RADIUS``) and the same distance on the WGS84 ellipsoid. The
+# ratio is bounded by the ellipsoid's radii of curvature, which range
+# from about 6335km (meridian, at the equator) to 6400km (at the poles).
+SPHERICAL_ERROR = 0.006
+
+# Half the length of a WGS84 meridian, in kilometers: no two points on
+# the ellipsoid are further apart than this.
+MAX_GEODESIC_DISTANCE = 20003.931458626
+
+
+class GeoPoint(object):
+    """A point (in numeric degrees) with its radians and the sine and
+    cosine of its latitude computed upfront.
+
+    The methods are versions of the module functions of the same names,
+    with this point as the first point, and skip the trigonometry for
+    it. That pays off when a point is used over and over again, e.g. as
+    the origin of many queries:
+
+    >>> depot = GeoPoint(48.76165, 11.41947)
+    >>> "%.8f" % depot.distance_haversine(48.75857, 11.42501)
+    '0.53122557'
+    >>> "%.8f" % depot.cross_track(48.75857, 11.42501, 48.76176, 11.41595)
+    '0.15697753'
+    >>> "%.5f, %.5f" % depot.destination(135, 10)
+    '48.69802, 11.51582'
+    """
+
+    __slots__ = ('lat', 'lon', 'phi', 'lam', 'sin_phi', 'cos_phi')
+
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+        self.phi = phi = radians(lat)
+        self.lam = radians(lon)
+        self.sin_phi = sin(phi)
+        self.cos_phi = cos(phi)
+
+    def __repr__(self):
+        return "<%s lat=%r lon=%r>" % (self.__class__.__name__, self.lat, self.lon)
+
+    def distance_haversine(self, lat, lon):
+        """See ``distance_haversine()``.
+        """
+        phi = radians(lat)
+        sin_dlat = sin((phi - self.phi) / 2)
+        sin_dlon = sin((radians(lon) - self.lam) / 2)
+        a = sin_dlat * sin_dlat + self.cos_phi * cos(phi) * sin_dlon * sin_dlon
+        return R * 2 * atan2(sqrt(a), sqrt(1 - a))
+
+    def distance_cosine(self, lat, lon):
+        """See ``distance_cosine()``.
+        """
+        phi = radians(lat)
+        return acos(self.sin_phi * sin(phi) + self.cos_phi * cos(phi) *
+                    cos(radians(lon) - self.lam)) * R
+
+    def bearing(self, lat, lon):
+        """See ``bearing()``.
+        """
+        phi = radians(lat)
+        dlon = radians(lon) - self.lam
+        cos2 = cos(phi)
+        return atan2(sin(dlon) * cos2,
+                     self.cos_phi * sin(phi) - self.sin_phi * cos2 * cos(dlon))
+
+    def bearing_degrees(self, lat, lon):
+        """See ``bearing_degrees()``.
+        """
+        return (degrees(self.bearing(lat, lon)) + 360) % 360
+
+    def destination(self, bearing, d):
+        """See ``destination()``.
+        """
+        bearing = radians(bearing)
+        sin1, cos1 = self.sin_phi, self.cos_phi
+        lat2 = asin(sin1 * cos(d/R) + cos1 * sin(d/R) * cos(bearing))
+        lon2 = self.lam + atan2(sin(bearing) * sin(d/R) * cos1,
+                                cos(d/R) - sin1 * sin(lat2))
+        lon2 = (lon2 + pi) % (2 * pi) - pi   # normalize to -180...+180
+        return degrees(lat2), degrees(lon2)
+
+    def cross_track(self, latB, lonB, latP, lonP):
+        """See ``cross_track()``; this point is A.
+        """
+        # distance_haversine(A, P) in radians, bearing(A, B) and bearing(A, P)
+        phiP, phiB = radians(latP), radians(latB)
+        sinA, cosA, cosP, cosB = self.sin_phi, self.cos_phi, cos(phiP), cos(phiB)
+        dlon = radians(lonP) - self.lam
+        sin_dlat, sin_dlon = sin((phiP - self.phi) / 2), sin(dlon / 2)
+        a = sin_dlat * sin_dlat + cosA * cosP * sin_dlon * sin_dlon
+        d13 = 2 * atan2(sqrt(a), sqrt(1 - a))
+        dlon12 = radians(lonB) - self.lam
+        brng12 = atan2(sin(dlon12) * cosB, cosA * sin(phiB) - sinA * cosB * cos(dlon12))
+        brng13 = atan2(sin(dlon) * cosP, cosA * sin(phiP) - sinA * cosP * cos(dlon))
+        return asin(sin(d13) * sin(brng13 - brng12)) * R
+
 
 def distance_haversine(lat1, lon1, lat2, lon2):
     """Use Haversine formula to calculate distance (in km) between two
@@ -95,7 +217,7 @@ def destination(lat, long, bearing, d):
     Returns a 2-tuple (lat, long), in degrees.
     """
     lat1 = radians(lat)
-    lon1 = radians(int)
+    lon1 = radians(long)
     bearing = radians(bearing)
 
     lat2 = asin(sin(lat1) * cos(d/R) + cos(lat1) * sin(d/R) * cos(bearing))
@@ -123,6 +245,463 @@ def cross_track(latA, lonA, latB, lonB, latP, lonP):
     return dXt
 
 
+def distance_vincenty(lat1, lon1, lat2, lon2):
+    """Use Vincenty's inverse formula to calculate the distance (in km)
+    between two points on the WGS84 ellipsoid, specified by
+    latitude/longitude (in numeric degrees).
+
+    Accurate to within a millimeter, but iterative and therefore a lot
+    slower than ``distance_haversine()``. For nearly antipodal points,
+    the formula may fail to converge, in which case a ``ValueError``
+    is raised.
+
+        http://www.movable-type.co.uk/scripts/latlong-vincenty.html
+        T. Vincenty, "Direct and Inverse Solutions of Geodesics on the
+        Ellipsoid with application of nested equations", Survey Review,
+        vol XXII no 176, 1975
+
+    >>> "%.6f" % distance_vincenty(-37.95103342, 144.42486789, -37.65282114, 143.92649554)
+    '54.972271'
+    """
+    a, b, f = WGS84_A, WGS84_B, WGS84_F
+
+    L = radians(lon2 - lon1)
+    U1 = atan2((1 - f) * sin(radians(lat1)), cos(radians(lat1)))
+    U2 = atan2((1 - f) * sin(radians(lat2)), cos(radians(lat2)))
+    sinU1, cosU1 = sin(U1), cos(U1)
+    sinU2, cosU2 = sin(U2), cos(U2)
+
+    lam = L
+    for i in range(200):
+        sinLam, cosLam = sin(lam), cos(lam)
+        sinSigma = sqrt((cosU2 * sinLam) ** 2 +
+                        (cosU1 * sinU2 - sinU1 * cosU2 * cosLam) ** 2)
+        if sinSigma == 0:
+            return 0.0   # coincident points
+        cosSigma = sinU1 * sinU2 + cosU1 * cosU2 * cosLam
+        sigma = atan2(sinSigma, cosSigma)
+        sinAlpha = cosU1 * cosU2 * sinLam / sinSigma
+        cosSqAlpha = 1 - sinAlpha ** 2
+        if cosSqAlpha:
+            cos2SigmaM = cosSigma - 2 * sinU1 * sinU2 / cosSqAlpha
+        else:
+            cos2SigmaM = 0.0   # equatorial line
+        C = f / 16 * cosSqAlpha * (4 + f * (4 - 3 * cosSqAlpha))
+        lamP = lam
+        lam = L + (1 - C) * f * sinAlpha * (sigma + C * sinSigma * (
+            cos2SigmaM + C * cosSigma * (-1 + 2 * cos2SigmaM ** 2)))
+        if abs(lam - lamP) < 1e-12:
+            break
+    else:
+        raise ValueError('Vincenty formula failed to converge')
+
+    uSq = cosSqAlpha * (a ** 2 - b ** 2) / b ** 2
+    A = 1 + uSq / 16384 * (4096 + uSq * (-768 + uSq * (320 - 175 * uSq)))
+    B = uSq / 1024 * (256 + uSq * (-128 + uSq * (74 - 47 * uSq)))
+    deltaSigma = B * sinSigma * (cos2SigmaM + B / 4 * (
+        cosSigma * (-1 + 2 * cos2SigmaM ** 2) - B / 6 * cos2SigmaM *
+        (-3 + 4 * sinSigma ** 2) * (-3 + 4 * cos2SigmaM ** 2)))
+    return b * A * (sigma - deltaSigma)
+
+
+def destination_vincenty(lat, long, bearing, d):
+    """Use Vincenty's direct formula to calculate the destination point
+    on the WGS84 ellipsoid, given a start point, initial bearing in
+    degrees and distance in kilometers.
+
+    Returns a 2-tuple (lat, long), in degrees.
+
+    >>> "%.8f, %.8f" % destination_vincenty(-37.95103342, 144.42486789, 306.86816, 54.972271)
+    '-37.65282114, 143.92649554'
+    """
+    a, b, f = WGS84_A, WGS84_B, WGS84_F
+
+    alpha1 = radians(bearing)
+    sinAlpha1, cosAlpha1 = sin(alpha1), cos(alpha1)
+    U1 = atan2((1 - f) * sin(radians(lat)), cos(radians(lat)))
+    sinU1, cosU1 = sin(U1), cos(U1)
+    sigma1 = atan2(sinU1, cosU1 * cosAlpha1)
+    sinAlpha = cosU1 * sinAlpha1
+    cosSqAlpha = 1 - sinAlpha ** 2
+    uSq = cosSqAlpha * (a ** 2 - b ** 2) / b ** 2
+    A = 1 + uSq / 16384 * (4096 + uSq * (-768 + uSq * (320 - 175 * uSq)))
+    B = uSq / 1024 * (256 + uSq * (-128 + uSq * (74 - 47 * uSq)))
+
+    sigma = d / (b * A)
+    for i in range(200):
+        cos2SigmaM = cos(2 * sigma1 + sigma)
+        sinSigma, cosSigma = sin(sigma), cos(sigma)
+        deltaSigma = B * sinSigma * (cos2SigmaM + B / 4 * (
+            cosSigma * (-1 + 2 * cos2SigmaM ** 2) - B / 6 * cos2SigmaM *
+            (-3 + 4 * sinSigma ** 2) * (-3 + 4 * cos2SigmaM ** 2)))
+        sigmaP = sigma
+        sigma = d / (b * A) + deltaSigma
+        if abs(sigma - sigmaP) < 1e-12:
+            break
+    cos2SigmaM = cos(2 * sigma1 + sigma)
+    sinSigma, cosSigma = sin(sigma), cos(sigma)
+
+    tmp = sinU1 * sinSigma - cosU1 * cosSigma * cosAlpha1
+    lat2 = atan2(sinU1 * cosSigma + cosU1 * sinSigma * cosAlpha1,
+                 (1 - f) * sqrt(sinAlpha ** 2 + tmp ** 2))
+    lam = atan2(sinSigma * sinAlpha1,
+                cosU1 * cosSigma - sinU1 * sinSigma * cosAlpha1)
+    C = f / 16 * cosSqAlpha * (4 + f * (4 - 3 * cosSqAlpha))
+    L = lam - (1 - C) * f * sinAlpha * (sigma + C * sinSigma * (
+        cos2SigmaM + C * cosSigma * (-1 + 2 * cos2SigmaM ** 2)))
+    lon2 = radians(long) + L
+    lon2 = (lon2 + pi) % (2 * pi) - pi   # normalize to -180...+180
+    return degrees(lat2), degrees(lon2)
+
+
+# Array versions of the functions above. They accept NumPy arrays (or
+# anything ``numpy.asarray`` understands, including plain scalars) and
+# broadcast their arguments against each other, so that a single origin
+# can be combined with an array of destinations, for example. Results
+# match the scalar versions within floating point tolerance.
+
+
+def _as_radians(*values):
+    if numpy is None:
+        raise ImportError('the array functions require NumPy')
+    return [numpy.radians(numpy.asarray(v, dtype=numpy.float64))
+            for v in values]
+
+
+def distance_haversine_array(lat1, lon1, lat2, lon2):
+    """Array version of ``distance_haversine()``.
+
+    >>> lats = numpy.array([48.75857, 52.5, -33.9])
+    >>> lons = numpy.array([11.42501, 13.4, 151.2])
+    >>> d = distance_haversine_array(48.76165, 11.41947, lats, lons)
+    >>> numpy.allclose(d, [distance_haversine(48.76165, 11.41947, a, b)
+    ...                    for a, b in zip(lats, lons)])
+    True
+    """
+    lat1, lon1, lat2, lon2 = _as_radians(lat1, lon1, lat2, lon2)
+    a = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * \
+        numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2
+    # Rounding can push ``a`` slightly above 1 for antipodal points.
+    a = numpy.minimum(a, 1.0)
+    return R * 2 * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))
+
+
+def distance_cosine_array(lat1, lon1, lat2, lon2):
+    """Array version of ``distance_cosine()``.
+    """
+    lat1, lon1, lat2, lon2 = _as_radians(lat1, lon1, lat2, lon2)
+    c = numpy.sin(lat1) * numpy.sin(lat2) + \
+        numpy.cos(lat1) * numpy.cos(lat2) * numpy.cos(lon2 - lon1)
+    return numpy.arccos(numpy.clip(c, -1.0, 1.0)) * R
+
+
+def bearing_array(lat1, lon1, lat2, lon2):
+    """Array version of ``bearing()``; returns radians.
+
+    >>> b = bearing_array([48.76165, 0], [11.41947, 0], [48.75857, 1], [11.42501, 1])
+    >>> numpy.allclose(b, [bearing(48.76165, 11.41947, 48.75857, 11.42501),
+    ...                    bearing(0, 0, 1, 1)])
+    True
+    """
+    lat1, lon1, lat2, lon2 = _as_radians(lat1, lon1, lat2, lon2)
+    dlon = lon2 - lon1
+    y = numpy.sin(dlon) * numpy.cos(lat2)
+    x = numpy.cos(lat1) * numpy.sin(lat2) - \
+        numpy.sin(lat1) * numpy.cos(lat2) * numpy.cos(dlon)
+    return numpy.arctan2(y, x)
+
+
+def bearing_degrees_array(lat1, lon1, lat2, lon2):
+    """Array version of ``bearing_degrees()``.
+    """
+    return (numpy.degrees(bearing_array(lat1, lon1, lat2, lon2)) + 360) % 360
+
+
+def destination_array(lat, long, bearing, d):
+    """Array version of ``destination()``.
+
+    Returns a 2-tuple of arrays (lats, longs), in degrees.
+
+    >>> lats, lons = destination_array(48.76, 11.42, [0, 90, 225], 10)
+    >>> numpy.allclose(numpy.transpose([lats, lons]),
+    ...                [destination(48.76, 11.42, b, 10) for b in (0, 90, 225)])
+    True
+    """
+    lat1, lon1, bearing = _as_radians(lat, long, bearing)
+    d = numpy.asarray(d, dtype=numpy.float64) / R
+
+    lat2 = numpy.arcsin(numpy.sin(lat1) * numpy.cos(d) +
+                        numpy.cos(lat1) * numpy.sin(d) * numpy.cos(bearing))
+    lon2 = lon1 + numpy.arctan2(numpy.sin(bearing) * numpy.sin(d) * numpy.cos(lat1),
+                                numpy.cos(d) - numpy.sin(lat1) * numpy.sin(lat2))
+    lon2 = (lon2 + pi) % (2 * pi) - pi   # normalize to -180...+180
+    return numpy.degrees(lat2), numpy.degrees(lon2)
+
+
+def cross_track_array(latA, lonA, latB, lonB, latP, lonP):
+    """Array version of ``cross_track()``.
+
+    >>> "%.8f" % cross_track_array(48.76165, 11.41947, 48.75857, 11.42501, 48.76176, 11.41595)
+    '0.15697753'
+    """
+    d13 = distance_haversine_array(latA, lonA, latP, lonP)
+    brng12 = bearing_array(latA, lonA, latB, lonB)
+    brng13 = bearing_array(latA, lonA, latP, lonP)
+    return numpy.arcsin(numpy.sin(d13 / R) * numpy.sin(brng13 - brng12)) * R
+
+
+def iter_distance_matrix(lats_a, lons_a, lats_b, lons_b, max_cells=2**20):
+    """Compute the haversine distances (in km) between every point in
+    ``a`` and every point in ``b``, yielding the matrix in row blocks.
+
+    Yields 2-tuples ``(offset, block)``, where ``block`` is an array of
+    shape (rows, len(lats_b)) holding the rows starting at index
+    ``offset`` of the full matrix. No block has more than
+    ``max_cells`` elements (but always at least one row), which bounds
+    memory usage even when the full matrix would not fit.
+
+    The radians and the cosines of the latitudes are computed only once
+    for each input point.
+
+    >>> blocks = list(iter_distance_matrix([0, 1, 2], [0, 1, 2], [0, 3], [0, 3], max_cells=4))
+    >>> [(offset, block.shape) for offset, block in blocks]
+    [(0, (2, 2)), (2, (1, 2))]
+    """
+    lat_a, lon_a, lat_b, lon_b = _as_radians(lats_a, lons_a, lats_b, lons_b)
+    lat_a, lon_a, lat_b, lon_b = [v.ravel() for v in (lat_a, lon_a, lat_b, lon_b)]
+    cos_a, cos_b = numpy.cos(lat_a), numpy.cos(lat_b)
+
+    rows = max(1, max_cells // max(1, len(lat_b)))
+    for offset in range(0, len(lat_a), rows):
+        end = offset + rows
+        # Build the block in place, to avoid allocating a new
+        # temporary array for every step of the formula.
+        dlat = numpy.subtract.outer(lat_a[offset:end], lat_b)
+        dlat *= 0.5
+        numpy.sin(dlat, out=dlat)
+        dlat *= dlat
+        a = numpy.subtract.outer(lon_a[offset:end], lon_b)
+        a *= 0.5
+        numpy.sin(a, out=a)
+        a *= a
+        a *= numpy.multiply.outer(cos_a[offset:end], cos_b)
+        a += dlat
+        numpy.minimum(a, 1.0, out=a)
+        numpy.sqrt(a, out=dlat)             # dlat is reused as sqrt(a)
+        numpy.subtract(1.0, a, out=a)
+        numpy.sqrt(a, out=a)
+        numpy.arctan2(dlat, a, out=a)
+        a *= 2 * R
+        yield offset, a
+
+
+def distance_matrix(lats_a, lons_a, lats_b, lons_b, max_cells=2**20):
+    """Return the full matrix of haversine distances (in km) between
+    the points in ``a`` (rows) and the points in ``b`` (columns).
+
+    The matrix is computed in blocks by ``iter_distance_matrix()``;
+    use that directly if the result is too large to be kept in memory.
+
+    >>> m = distance_matrix([0, 48.76165], [0, 11.41947], [48.75857, 0], [11.42501, 0])
+    >>> numpy.allclose(m, [[distance_haversine(a, b, c, d) for (c, d) in
+    ...                     ((48.75857, 11.42501), (0, 0))]
+    ...                    for (a, b) in ((0, 0), (48.76165, 11.41947))])
+    True
+    """
+    result = numpy.empty((numpy.size(lats_a), numpy.size(lats_b)))
+    for offset, block in iter_distance_matrix(lats_a, lons_a, lats_b, lons_b,
+                                              max_cells):
+        result[offset:offset + len(block)] = block
+    return result
+
+
+def _unit_vectors(lats, lons):
+    """Convert lat/lon arrays (in radians) to an (n, 3) array of
+    vectors on the unit sphere.
+    """
+    cos_lat = numpy.cos(lats)
+    return numpy.column_stack((cos_lat * numpy.cos(lons),
+                               cos_lat * numpy.sin(lons), numpy.sin(lats)))
+
+
+def cross_track_route(lats, lons, route_lats, route_lons, return_segments=False):
+    """Returns the distance (in km) of every point P from a route, given
+    as a polyline of great-circle segments.
+
+    Different from ``cross_track()``, this measures the distance to
+    the segments, not the infinite great circles through them: if the
+    foot of the perpendicular from P lies outside of a segment, the
+    distance to the nearer of the segment's endpoints is used instead.
+
+    Bearings and lengths of the segments are computed only once. Each
+    segment (and each group of consecutive segments) is enclosed in a
+    3D bounding box, and the exact distance is only calculated for
+    those points for which the box could hold something closer than
+    the best segment found so far.
+
+    If ``return_segments`` is set, a 2-tuple (distances, segments) is
+    returned, with ``segments`` holding the index of the closest
+    segment for every point.
+
+    >>> d = cross_track_route([48.76176, 48.75], [11.41595, 11.43],
+    ...                       [48.76165, 48.75857, 48.74], [11.41947, 11.42501, 11.43])
+    >>> ["%.8f" % v for v in d]
+    ['0.25830164', '0.19395499']
+
+    Beyond either end of a segment, the nearer endpoint counts, which
+    for a long segment need not be the one on that side:
+
+    >>> "%.3f" % cross_track_route([0], [-150], [0, 0], [0, 120])[0]
+    '10007.543'
+    """
+    latP, lonP, lat_r, lon_r = _as_radians(lats, lons, route_lats, route_lons)
+    latP, lonP, lat_r, lon_r = [v.ravel() for v in (latP, lonP, lat_r, lon_r)]
+    if len(lat_r) < 2:
+        raise ValueError('a route needs at least two points')
+
+    P = _unit_vectors(latP, lonP)
+    V = _unit_vectors(lat_r, lon_r)
+    cos_latP = numpy.cos(latP)
+    cos_lat_r = numpy.cos(lat_r)
+
+    # Per-segment bearing and (angular) length.
+    latA, lonA, latB, lonB = lat_r[:-1], lon_r[:-1], lat_r[1:], lon_r[1:]
+    dlon = lonB - lonA
+    brng12 = numpy.arctan2(
+        numpy.sin(dlon) * cos_lat_r[1:],
+        cos_lat_r[:-1] * numpy.sin(latB) -
+            numpy.sin(latA) * cos_lat_r[1:] * numpy.cos(dlon))
+    d12 = numpy.sum((V[1:] - V[:-1]) ** 2, axis=1)
+    d12 = 2 * numpy.arcsin(numpy.minimum(numpy.sqrt(d12) / 2, 1))
+
+    # The arc between A and B lies within the triangle formed by A, B
+    # and the intersection of the tangents in A and B, which is at
+    # (A + B) / (1 + A.B). For (nearly) antipodal endpoints, fall back
+    # to the bounds of the whole sphere.
+    A, B = V[:-1], V[1:]
+    dot = numpy.einsum('ij,ij->i', A, B)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        T = (A + B) / (1 + dot)[:, numpy.newaxis]
+    antipodal = dot < -0.999
+    lower = numpy.minimum(numpy.minimum(A, B), T)
+    upper = numpy.maximum(numpy.maximum(A, B), T)
+    lower[antipodal], upper[antipodal] = -1, 1
+
+    def angle(chord):
+        return 2 * numpy.arcsin(numpy.minimum(chord / 2, 1))
+
+    def vertex_distance(p, v):
+        # haversine between points ``p`` and route vertex ``v``
+        a = numpy.sin((lat_r[v] - latP[p]) / 2) ** 2 + cos_latP[p] * \
+            cos_lat_r[v] * numpy.sin((lon_r[v] - lonP[p]) / 2) ** 2
+        a = numpy.minimum(a, 1.0)
+        return 2 * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))
+
+    def box_distance(Q, lower, upper):
+        # lower bound for the angular distance of vectors Q to a box
+        gap = numpy.maximum(lower - Q, 0) + numpy.maximum(Q - upper, 0)
+        return angle(numpy.sqrt(numpy.einsum('ij,ij->i', gap, gap)))
+
+    # Segments are processed in groups. The box around a whole group is
+    # tested against all points, the boxes of the individual segments
+    # only against the points that passed the group test.
+    groups = range(0, len(A), 32)
+
+    # Any vertex is an upper bound for the closest segment, and is cheap
+    # to find with chord lengths. Use the first vertex of every group,
+    # to give the box tests something to prune against from the start.
+    best = numpy.full(len(P), numpy.inf)
+    segments = numpy.zeros(len(P), dtype=numpy.intp)
+    for g in groups:
+        diff = P - V[g]
+        chord = numpy.sqrt(numpy.einsum('ij,ij->i', diff, diff))
+        closer = chord < best
+        best[closer] = chord[closer]
+        segments[closer] = g
+    best = angle(best) + 1e-12
+
+    for g in groups:
+        candidates = numpy.flatnonzero(box_distance(
+            P, lower[g:g + 32].min(axis=0), upper[g:g + 32].max(axis=0)) < best)
+        if not len(candidates):
+            continue
+        for s in range(g, min(g + 32, len(A))):
+            p = candidates[box_distance(P[candidates], lower[s], upper[s])
+                           < best[candidates]]
+            if not len(p):
+                continue
+
+            d13 = vertex_distance(p, s)
+            dlon = lonP[p] - lonA[s]
+            brng13 = numpy.arctan2(
+                numpy.sin(dlon) * cos_latP[p],
+                cos_lat_r[s] * numpy.sin(latP[p]) -
+                    numpy.sin(latA[s]) * cos_latP[p] * numpy.cos(dlon))
+            dtheta = brng13 - brng12[s]
+            xt = numpy.arcsin(numpy.clip(numpy.sin(d13) * numpy.sin(dtheta), -1, 1))
+            at = numpy.arccos(numpy.clip(numpy.cos(d13) / numpy.cos(xt), -1, 1))
+            at[numpy.cos(dtheta) < 0] *= -1
+
+            # On long segments, either endpoint can be the nearer one,
+            # no matter on which side the foot falls.
+            dist = numpy.abs(xt)
+            outside = (at < 0) | (at > d12[s])
+            if outside.any():
+                dist[outside] = numpy.minimum(
+                    d13[outside], vertex_distance(p[outside], s + 1))
+
+            closer = dist < best[p]
+            best[p[closer]] = dist[closer]
+            segments[p[closer]] = s
+
+    best *= R
+    if return_segments:
+        return best, segments
+    return best
+
+
+def within_distance(lat, lon, lats, lons, distance):
+    """Return a boolean array indicating which of the points given by
+    ``lats`` and ``lons`` are within ``distance`` km of the point
+    (``lat``, ``lon``), as measured on the WGS84 ellipsoid.
+
+    The exact (and slow) ``distance_vincenty()`` only runs on those
+    candidates close to the threshold: a vectorized haversine pass
+    decides all points whose spherical distance is further than
+    ``SPHERICAL_ERROR`` away from it.
+
+    For nearly antipodal points, where ``distance_vincenty()`` does not
+    converge, Karney's method from geographiclib is used. Without it,
+    such points are only decided if ``distance`` is at least
+    ``MAX_GEODESIC_DISTANCE``, otherwise a ``ValueError`` is raised.
+
+    >>> within_distance(0, 0, [0, 0, 0, 1], [0.1, 0.898, 0.899, 1], 100).tolist()
+    [True, True, False, False]
+    >>> within_distance(0, 0, [0.5], [179.7], 20010).tolist()
+    [True]
+    """
+    lats = numpy.asarray(lats, dtype=numpy.float64).ravel()
+    lons = numpy.asarray(lons, dtype=numpy.float64).ravel()
+    spherical = distance_haversine_array(lat, lon, lats, lons)
+
+    result = spherical <= distance * (1 - SPHERICAL_ERROR)
+    uncertain = numpy.flatnonzero(~result &
+                                  (spherical <= distance * (1 + SPHERICAL_ERROR)))
+    for i in uncertain.tolist():
+        try:
+            exact = distance_vincenty(lat, lon, lats[i], lons[i])
+        except ValueError:
+            if Geodesic is None:
+                if distance >= MAX_GEODESIC_DISTANCE:
+                    result[i] = True
+                    continue
+                raise ValueError('nearly antipodal points require '
+                                 'geographiclib')
+            exact = Geodesic.WGS84.Inverse(lat, lon, lats[i], lons[i])['s12'] / 1000
+        result[i] = exact <= distance
+    return result
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
\ No newline at end of file
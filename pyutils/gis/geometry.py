@@ -1,9 +1,22 @@
 """
 Uses Shapely:
     http://pypi.python.org/pypi/Shapely/
+
+The functions here are adapters that take and return Shapely objects;
+the actual work is done by ``pyutils.gis.planar``, which operates on
+plain coordinate tuples and does not need Shapely at all.
 """
 
-from shapely.geometry import *
+try:
+    import numpy
+    from shapely.geometry import *
+except ImportError:
+    # Allow the Shapely-free parts, like ``PolygonIndex``, to be used
+    # through this module as well.
+    pass
+
+from . import planar
+from .planar import PolygonIndex
 
 
 def closest_point_on_segment(p, a, b, extend=False):
@@ -12,41 +25,18 @@ def closest_point_on_segment(p, a, b, extend=False):
     If ``extend`` is set, the returned point may be on the extension
     between of ab.
 
-    Ported from PostGIS:
-        http://trac.osgeo.org/postgis/browser/trunk/lwgeom/ptarray.c?rev=2277#L542
-
-    Based on comp.graphics.algorithms FAQ:
-        http://www.faqs.org/faqs/graphics/algorithms-faq/
-
-        (1)           AC dot AB
-                  r = ----------
-                       ||AB||^2
-             r has the following meaning:
-             r=0 P = A
-             r=1 P = B
-             r<0 P is on the backward extension of AB
-             r>1 P is on the forward extension of AB
-             0<r<1 P is interior to AB
-
-    See also:
-        http://mathworld.wolfram.com/Point-LineDistance2-Dimensional.html
+    See ``planar.closest_point_on_segment()``, which this wraps, and
+    which is what you want to use if you don't need Shapely objects.
     """
     if a == b:
         return a
 
-    r = ( (p.x-a.x) * (b.x-a.x) + (p.y-a.y) * (b.y-a.y) ) /     \
-             ( (b.x-a.x)*(b.x-a.x) + (b.y-a.y)*(b.y-a.y) )
-
-    if not extend:
-        if r<0: return a
-        elif r>1: return b
-
-    return Point(a.x + ((b.x - a.x) * r),
-                 a.y + ((b.y - a.y) * r))
+    result = planar.closest_point_on_segment(
+        (p.x, p.y), (a.x, a.y), (b.x, b.y), extend)
+    return Point(result)
 
 
-
-def line_locate_point(line, point):
+def line_locate_point(line, point, fraction=False):
     """Return point on C{LineString} ``line`` closest to the given
     C{Point}.
 
@@ -54,7 +44,12 @@ def line_locate_point(line, point):
         http://trac.osgeo.org/postgis/browser/trunk/lwgeom/ptarray.c?rev=2277#L584
 
     Different from the PostGIS version, this returns an actual point
-    object, rather than a scaled location of the point on the line.
+    object, rather than a scaled location of the point on the line. If
+    ``fraction`` is set, a 2-tuple (point, location) is returned, with
+    ``location`` being the scaled location PostGIS would return: a
+    float between 0 and 1, the fraction of the total line length.
+
+    See ``planar.locate_point()``, which this wraps.
 
     >>> l = LineString(((0,0), (0,10), (10,10),))
     >>> str(line_locate_point(l, Point(5,5)))
@@ -65,26 +60,38 @@ def line_locate_point(line, point):
     'POINT (0.0000000000000000 0.0000000000000000)'
     >>> str(line_locate_point(l, Point(0,10)))
     'POINT (0.0000000000000000 10.0000000000000000)'
+    >>> line_locate_point(l, Point(5,6), fraction=True)[1]
+    0.75
     """
+    result = planar.locate_point(numpy.asarray(line.coords), (point.x, point.y),
+                                 fraction)
+    if fraction:
+        return Point(result[0]), result[1]
+    return Point(result)
 
-    start = end = min_dist = seg = None
 
-    it = iter(line.coords)
-    start = next(it)
-    while True:
-        try:
-            end = next(it)
-        except StopIteration:
-            break;
 
-        dist = LineString((start, end,)).distance(point)
-        if min_dist is None or dist < min_dist:
-            min_dist = dist
-            seg = (start, end,)
+def points_in_polygon(points, polygon):
+    """Test many points against a C{Polygon} or C{MultiPolygon} at
+    once; returns a boolean NumPy array, true for the points inside.
 
-        start = end
+    ``points`` may be a sequence of C{Point}s or of (x, y) tuples, or an
+    (n, 2) array; ``polygon`` may also be given as a ring of
+    coordinates. This replaces a ``polygon.contains(point)`` call per
+    point; points exactly on the boundary may be counted either way.
 
-    return closest_point_on_segment(point, *[Point(c) for c in seg])
+    See ``planar.PolygonIndex``, which does the work, and which should
+    be used directly to test against many polygons at once.
+
+    >>> p = Polygon(((0,0), (10,0), (10,10), (0,10)), [((2,2), (4,2), (4,4))])
+    >>> points_in_polygon([Point(1,1), Point(3.5,2.5), Point(11,5)], p).tolist()
+    [True, False, False]
+    >>> m = MultiPolygon([p, Polygon(((20,0), (21,0), (21,2)))])
+    >>> points_in_polygon([(1, 1), (20.8, 1)], m).tolist()
+    [True, True]
+    """
+    parts = list(polygon.geoms) if hasattr(polygon, 'geoms') else [polygon]
+    return PolygonIndex(parts).locate(points) >= 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,193 @@
+"""Spatial index for nearest-neighbour queries on latitude/longitude
+points.
+
+The points are converted to 3D vectors on the unit sphere and stored
+in a k-d tree. The straight-line (chord) distance between two such
+vectors grows monotonically with their great-circle distance, so the
+tree can be searched with cheap euclidean bounding-box tests, while
+all reported distances use the same spherical Earth model as
+``geodesy.EARTH_RADIUS``.
+
+Requires NumPy.
+"""
+
+import heapq
+from math import radians, sin, cos, pi
+
+import numpy
+
+from .geodesy import EARTH_RADIUS, distance_haversine_array
+
+
+__all__ = ('PointIndex',)
+
+
+def _to_vectors(lats, lons):
+    lats = numpy.radians(numpy.asarray(lats, dtype=numpy.float64).ravel())
+    lons = numpy.radians(numpy.asarray(lons, dtype=numpy.float64).ravel())
+    cos_lat = numpy.cos(lats)
+    return numpy.column_stack((cos_lat * numpy.cos(lons),
+                               cos_lat * numpy.sin(lons),
+                               numpy.sin(lats)))
+
+
+def _to_vector(lat, lon):
+    lat, lon = radians(lat), radians(lon)
+    return numpy.array((cos(lat) * cos(lon), cos(lat) * sin(lon), sin(lat)))
+
+
+def _chord(distance):
+    """Convert a great-circle distance in km into a chord length on
+    the unit sphere.
+    """
+    return 2 * sin(min(distance / EARTH_RADIUS, pi) / 2)
+
+
+class PointIndex(object):
+    """A k-d tree over a fixed set of lat/lon points (in degrees).
+
+    Building the index takes O(n log n); queries visit only the parts
+    of the tree that can contain a result.
+
+    >>> index = PointIndex([0, 10, 20, 48.76165], [0, 10, 20, 11.41947])
+    >>> [(round(d, 3), i) for d, i in index.nearest(48.75857, 11.42501, k=2)]
+    [(0.531, 3), (3288.336, 2)]
+    >>> [i for d, i in index.within(0, 0, 2000)]
+    [0, 1]
+    """
+
+    def __init__(self, lats, lons, leaf_size=32):
+        self.lats = numpy.asarray(lats, dtype=numpy.float64).ravel()
+        self.lons = numpy.asarray(lons, dtype=numpy.float64).ravel()
+        if len(self.lats) != len(self.lons):
+            raise ValueError('lats and lons must have the same length')
+        self.leaf_size = leaf_size
+        self._build(_to_vectors(self.lats, self.lons))
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _build(self, vectors):
+        order = numpy.arange(len(vectors))
+        # Node data, indexed by node id: the slice of ``order`` that
+        # the node covers, its children (-1 for leafs) and its bounds.
+        starts, ends, lower, upper, children = [], [], [], [], []
+
+        def add_node(start, end):
+            starts.append(start)
+            ends.append(end)
+            points = vectors[order[start:end]]
+            lower.append(points.min(axis=0))
+            upper.append(points.max(axis=0))
+            children.append([-1, -1])
+            return len(starts) - 1
+
+        # Build iteratively, so that large inputs cannot exceed the
+        # recursion limit.
+        stack = [add_node(0, len(order))] if len(order) else []
+        while stack:
+            node = stack.pop()
+            start, end = starts[node], ends[node]
+            if end - start <= self.leaf_size:
+                continue
+            axis = numpy.argmax(upper[node] - lower[node])
+            middle = (start + end) // 2
+            part = numpy.argpartition(vectors[order[start:end], axis],
+                                      middle - start)
+            order[start:end] = order[start:end][part]
+            children[node] = [add_node(start, middle), add_node(middle, end)]
+            stack.extend(children[node])
+
+        self._order = order
+        self._vectors = vectors[order]
+        self._starts = starts
+        self._ends = ends
+        self._lower = numpy.array(lower).reshape(-1, 3)
+        self._upper = numpy.array(upper).reshape(-1, 3)
+        self._children = children
+
+    def _min_chord(self, node, vector):
+        """Lower bound for the chord distance between ``vector`` and
+        any point inside ``node``.
+        """
+        gap = numpy.maximum(self._lower[node] - vector, 0) + \
+              numpy.maximum(vector - self._upper[node], 0)
+        return numpy.sqrt(gap.dot(gap))
+
+    def _leaf_chords(self, node, vector):
+        diff = self._vectors[self._starts[node]:self._ends[node]] - vector
+        return numpy.sqrt(numpy.einsum('ij,ij->i', diff, diff))
+
+    def _result(self, lat, lon, indices):
+        """Return ``(distance, index)`` tuples sorted by distance, with
+        the distances computed by the haversine formula.
+        """
+        indices = numpy.asarray(indices, dtype=numpy.intp)
+        distances = distance_haversine_array(
+            lat, lon, self.lats[indices], self.lons[indices])
+        return sorted(zip(distances.tolist(), indices.tolist()))
+
+    def nearest(self, lat, lon, k=1):
+        """Return the ``k`` points closest to the given location, as a
+        list of ``(distance, index)`` tuples, sorted by distance (in
+        km). ``index`` refers to the position of the point in the
+        arrays the index was built from.
+        """
+        if not len(self) or k < 1:
+            return []
+        vector = _to_vector(lat, lon)
+        best = []   # max-heap of (-chord, index) with the k best so far
+        queue = [(0.0, 0)]
+        while queue:
+            bound, node = heapq.heappop(queue)
+            if len(best) == k and bound > -best[0][0]:
+                break
+            left, right = self._children[node]
+            if left == -1:
+                chords = self._leaf_chords(node, vector)
+                offset = self._starts[node]
+                for i in numpy.argsort(chords)[:k].tolist():
+                    if len(best) < k:
+                        heapq.heappush(best, (-chords[i], offset + i))
+                    elif chords[i] < -best[0][0]:
+                        heapq.heapreplace(best, (-chords[i], offset + i))
+                    else:
+                        break
+            else:
+                for child in (left, right):
+                    heapq.heappush(queue, (self._min_chord(child, vector), child))
+        return self._result(lat, lon, self._order[[i for _, i in best]])
+
+    def within(self, lat, lon, radius):
+        """Return all points within ``radius`` km of the given location,
+        as a list of ``(distance, index)`` tuples sorted by distance.
+        """
+        if not len(self):
+            return []
+        vector = _to_vector(lat, lon)
+        # Allow for some rounding error in the chord comparison; the
+        # candidates are checked against the exact distance below.
+        limit = _chord(radius) + 1e-12
+        found = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self._min_chord(node, vector) > limit:
+                continue
+            left, right = self._children[node]
+            if left == -1:
+                chords = self._leaf_chords(node, vector)
+                found.append(self._starts[node] +
+                             numpy.flatnonzero(chords <= limit))
+            else:
+                stack.extend((left, right))
+        if not found:
+            return []
+        return [(d, i) for d, i in
+                self._result(lat, lon, self._order[numpy.concatenate(found)])
+                if d <= radius]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,168 @@
+"""Run the ``*_array`` functions of ``pyutils.gis.geodesy`` on multiple
+processes, for batches too large for a single core.
+
+The input arrays are copied once into a block of shared memory, which
+the worker processes attach to; they only receive the bounds of the
+chunk to work on, and write their results into a second shared block.
+No array data is pickled. Scalar inputs are passed to the workers as
+values instead.
+
+Requires NumPy.
+"""
+
+from multiprocessing import Pool, shared_memory
+
+import numpy
+
+from . import geodesy
+
+
+__all__ = ('FUNCTIONS', 'compute', 'iter_compute',)
+
+
+# The functions that can be run, with the number of arrays they return.
+FUNCTIONS = {
+    'distance_haversine': 1,
+    'distance_cosine': 1,
+    'bearing': 1,
+    'bearing_degrees': 1,
+    'destination': 2,
+    'cross_track': 1,
+}
+
+
+def _function(name):
+    if name not in FUNCTIONS:
+        raise ValueError('unsupported function: %r' % (name,))
+    return getattr(geodesy, name + '_array')
+
+
+def _arguments(values, arrays, start, end):
+    """The arguments for the elements from ``start`` to ``end``: the
+    ``values``, with each ``None`` replaced by a slice of the next of
+    the ``arrays``.
+    """
+    arrays = iter(arrays)
+    return [next(arrays)[start:end] if value is None else value
+            for value in values]
+
+
+# The shared arrays of a worker process, set up by ``_init_worker()``.
+_worker = {}
+
+def _init_worker(name, inputs, outputs, shape, values):
+    # The workers share the resource tracker of the process that
+    # created the blocks, which also unlinks them.
+    inputs_block = shared_memory.SharedMemory(name=inputs)
+    outputs_block = shared_memory.SharedMemory(name=outputs)
+    _worker.update(
+        blocks=(inputs_block, outputs_block),
+        function=_function(name),
+        values=values,
+        inputs=numpy.ndarray(shape, numpy.float64, inputs_block.buf),
+        outputs=numpy.ndarray((FUNCTIONS[name], shape[1]), numpy.float64,
+                              outputs_block.buf))
+
+
+def _compute_chunk(bounds):
+    start, end = bounds
+    result = _worker['function'](*_arguments(
+        _worker['values'], _worker['inputs'], start, end))
+    _worker['outputs'][:, start:end] = result
+    return bounds
+
+
+def iter_compute(name, *arrays, processes=None, chunk_size=2**20):
+    """Run the array version of the ``geodesy`` function ``name`` (see
+    ``FUNCTIONS``) over the given arrays, in chunks of ``chunk_size``
+    elements, on ``processes`` worker processes (by default one per
+    CPU).
+
+    The arrays are broadcast against each other, as the function itself
+    would do, and flattened; single values are passed on as they are.
+    Yields 2-tuples ``(offset, block)`` in
+    order, where ``block`` holds the results for the elements starting
+    at ``offset``: an array, or a tuple of arrays for ``destination``.
+
+    Inputs that fit into a single chunk are computed right away,
+    without starting any processes.
+
+    >>> blocks = list(iter_compute('distance_haversine', [0, 10, 20], 0, 0, 0,
+    ...                            chunk_size=2, processes=2))
+    >>> [(offset, block.round(3).tolist()) for offset, block in blocks]
+    [(0, [0.0, 1111.949]), (2, [2223.899])]
+    """
+    function = _function(name)
+    outputs = FUNCTIONS[name]
+    arrays = [numpy.asarray(a, dtype=numpy.float64) for a in arrays]
+    broadcast = numpy.broadcast(*arrays)
+    size = broadcast.size
+    # The single values (``None`` for the arrays), and the arrays.
+    values = [a.item() if a.size == 1 < size else None for a in arrays]
+    arrays = [a for a, value in zip(arrays, values) if value is None]
+
+    def result(block):
+        return tuple(block) if outputs > 1 else block[0]
+
+    if size <= chunk_size or processes == 1:
+        arrays = [numpy.broadcast_to(a, broadcast.shape).ravel()
+                  for a in arrays]
+        for start in range(0, size, chunk_size):
+            yield start, function(*_arguments(values, arrays, start,
+                                              start + chunk_size))
+        return
+
+    shape = (len(arrays), size)
+    inputs = shared_memory.SharedMemory(create=True, size=8 * shape[0] * size)
+    results = shared_memory.SharedMemory(create=True, size=8 * outputs * size)
+    pool = None
+    try:
+        shared = numpy.ndarray(shape, numpy.float64, inputs.buf)
+        for i, a in enumerate(arrays):
+            shared[i].reshape(broadcast.shape)[...] = a
+        del shared
+        output = numpy.ndarray((outputs, size), numpy.float64, results.buf)
+
+        pool = Pool(processes, _init_worker,
+                    (name, inputs.name, results.name, shape, values))
+        chunks = [(start, min(start + chunk_size, size))
+                  for start in range(0, size, chunk_size)]
+        for start, end in pool.imap(_compute_chunk, chunks):
+            yield start, result(output[:, start:end].copy())
+        del output
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        inputs.close()
+        inputs.unlink()
+        results.close()
+        results.unlink()
+
+
+def compute(name, *arrays, processes=None, chunk_size=2**20):
+    """Like ``iter_compute()``, but return the complete result: an
+    array, or a tuple of arrays for ``destination``.
+
+    >>> d = compute('distance_haversine', [0, 10, 20], 0, 0, 0, chunk_size=2)
+    >>> numpy.allclose(d, geodesy.distance_haversine_array([0, 10, 20], 0, 0, 0))
+    True
+    >>> lats, lons = compute('destination', 0, 0, [0, 90], 100, processes=1)
+    >>> numpy.round([lats, lons], 3).tolist()
+    [[0.899, 0.0], [0.0, 0.899]]
+    """
+    outputs = FUNCTIONS.get(name, 1)
+    result = numpy.empty((outputs, numpy.broadcast(
+        *[numpy.asarray(a) for a in arrays]).size))
+    for start, block in iter_compute(name, *arrays, processes=processes,
+                                     chunk_size=chunk_size):
+        if outputs == 1:
+            block = (block,)
+        for row, values in zip(result, block):
+            row[start:start + len(values)] = values
+    return tuple(result) if outputs > 1 else result[0]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
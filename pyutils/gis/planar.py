@@ -0,0 +1,605 @@
+"""Planar geometry on plain coordinates.
+
+Points are (x, y) tuples (or any sequence of two numbers), lines are
+sequences of points. Nothing here allocates geometry objects or needs
+Shapely, which makes these functions cheap to import and to call in hot
+loops. ``pyutils.gis.geometry`` provides the same functionality for
+Shapely objects on top of this module.
+
+NumPy is used for vectorized code paths if available; ``LineIndex``
+requires it. It is only imported on first use, as it would otherwise
+dominate the import time of this module.
+"""
+
+from math import hypot
+
+
+numpy = None
+_numpy_checked = False
+
+def _load_numpy():
+    """Import NumPy, if available, into the module namespace.
+    """
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+        except ImportError:
+            pass
+        _numpy_checked = True
+    return numpy
+
+
+__all__ = ('closest_point_on_segment', 'locate_point', 'LineIndex',
+           'PolygonIndex',)
+
+
+def closest_point_on_segment(p, a, b, extend=False):
+    """The point between ``a`` and ``b`` closest to ``p``.
+
+    If ``extend`` is set, the returned point may be on the extension
+    between of ab.
+
+    Ported from PostGIS:
+        http://trac.osgeo.org/postgis/browser/trunk/lwgeom/ptarray.c?rev=2277#L542
+
+    Based on comp.graphics.algorithms FAQ:
+        http://www.faqs.org/faqs/graphics/algorithms-faq/
+
+        (1)           AC dot AB
+                  r = ----------
+                       ||AB||^2
+             r has the following meaning:
+             r=0 P = A
+             r=1 P = B
+             r<0 P is on the backward extension of AB
+             r>1 P is on the forward extension of AB
+             0<r<1 P is interior to AB
+
+    See also:
+        http://mathworld.wolfram.com/Point-LineDistance2-Dimensional.html
+
+    >>> closest_point_on_segment((5, 5), (0, 0), (0, 10))
+    (0.0, 5.0)
+    >>> closest_point_on_segment((5, 15), (0, 0), (0, 10))
+    (0, 10)
+    """
+    ax, ay = a[0], a[1]
+    dx, dy = b[0] - ax, b[1] - ay
+    if not dx and not dy:
+        return a
+
+    r = ( (p[0]-ax) * dx + (p[1]-ay) * dy ) / ( dx*dx + dy*dy )
+
+    if not extend:
+        if r<0: return a
+        elif r>1: return b
+
+    return (ax + dx * r, ay + dy * r)
+
+
+def _project(p, a, ab, length2):
+    """Project point ``p`` onto the segments starting at the points
+    ``a`` with direction vectors ``ab`` (and their squared lengths
+    ``length2``), all in one vectorized pass.
+
+    Returns a 3-tuple (index, r, squared distance) for the closest
+    segment, with ``r`` being the position of the closest point on it,
+    in the sense described in ``closest_point_on_segment()``, but
+    clamped to 0...1.
+    """
+    r, dist = _positions(p - a, ab, length2)
+    i = int(numpy.argmin(dist))
+    return i, float(r[i]), float(dist[i])
+
+
+def _positions(ap, ab, length2):
+    """The element-wise part of ``_project()``: for the vectors ``ap``
+    from the segment starts to the points, return the arrays of ``r``
+    and of the squared distances.
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        r = numpy.einsum('ij,ij->i', ap, ab) / length2
+    r[length2 == 0] = 0
+    numpy.clip(r, 0, 1, out=r)
+    diff = ap - ab * r[:, numpy.newaxis]
+    return r, numpy.einsum('ij,ij->i', diff, diff)
+
+
+def _locate_loop(coords, x, y):
+    """Pure Python version of ``_project()``, for a sequence of
+    coordinates; returns only the segment index.
+    """
+    best = best_dist = None
+    it = iter(coords)
+    ax, ay = next(it)[:2]
+    for i, b in enumerate(it):
+        bx, by = b[0], b[1]
+        dx, dy = bx - ax, by - ay
+        length2 = dx*dx + dy*dy
+        r = length2 and ((x-ax) * dx + (y-ay) * dy) / length2
+        r = min(max(r, 0), 1)
+        ex, ey = ax + dx * r - x, ay + dy * r - y
+        dist = ex*ex + ey*ey
+        if best is None or dist < best_dist:
+            best, best_dist = i, dist
+        ax, ay = bx, by
+    return best
+
+
+def locate_point(coords, p, fraction=False):
+    """Return the point on the line given by ``coords`` closest to the
+    point ``p``, as an (x, y) tuple.
+
+    If ``fraction`` is set, a 2-tuple (point, location) is returned,
+    with ``location`` being a float between 0 and 1: the fraction of
+    the total line length at which the point lies.
+
+    If NumPy is available, all segments are checked in one vectorized
+    pass over the coordinates, which are best passed as an (n, 2)
+    array then, rather than converted from tuples on every call.
+
+    >>> locate_point(((0,0), (0,10), (10,10),), (5, 5))
+    (0.0, 5.0)
+    >>> locate_point(((0,0), (0,10), (10,10),), (5, 6), fraction=True)
+    ((5.0, 10.0), 0.75)
+    """
+    x, y = p[0], p[1]
+    if _load_numpy() is not None:
+        array = numpy.asarray(coords, dtype=numpy.float64)[:, :2]
+        ab = array[1:] - array[:-1]
+        i = _project(numpy.array((x, y)), array[:-1], ab,
+                     numpy.einsum('ij,ij->i', ab, ab))[0]
+        a, b = tuple(array[i].tolist()), tuple(array[i + 1].tolist())
+        if fraction:
+            lengths = numpy.hypot(*ab.T)
+            before, total = float(lengths[:i].sum()), float(lengths.sum())
+    else:
+        i = _locate_loop(coords, x, y)
+        a, b = tuple(coords[i][:2]), tuple(coords[i + 1][:2])
+        if fraction:
+            lengths = [hypot(d[0] - c[0], d[1] - c[1])
+                       for c, d in zip(coords[:-1], coords[1:])]
+            before, total = float(sum(lengths[:i])), float(sum(lengths))
+
+    result = closest_point_on_segment((x, y), a, b)
+    if not fraction:
+        return result
+
+    if not total:
+        return result, 0.0
+    location = before + hypot(result[0] - a[0], result[1] - a[1])
+    return result, location / total
+
+
+class LineIndex(object):
+    """Snaps points onto a line, like ``line_locate_point()``, but
+    builds a spatial index of the line's segments once, so that many
+    points can be snapped without rescanning every segment each time.
+
+    The index is a packed R-tree over the bounding boxes of the
+    segments. Consecutive segments of a line are close to each other,
+    so they are simply grouped in order: every ``node_size`` segments
+    form a leaf, every ``node_size`` leafs a node of the next level,
+    and so on. A batch of points descends the tree one level at a time,
+    all points at once. A box is dropped for a point if it is further
+    from it than some other box is guaranteed to hold a segment: each
+    side of a box touches one of its segments, so there is one within
+    the distance to the far end of the nearer side, along either axis.
+
+    ``line`` may be a sequence of coordinates or anything with a
+    ``coords`` attribute, like a Shapely C{LineString}. Requires NumPy.
+
+    >>> index = LineIndex(((0,0), (0,10), (10,10),))
+    >>> points, segments = index.snap([(5, 5), (5, 6), (0, 0), (0, 10)])
+    >>> points.tolist(), segments.tolist()
+    ([[0.0, 5.0], [5.0, 10.0], [0.0, 0.0], [0.0, 10.0]], [0, 1, 0, 0])
+    """
+
+    def __init__(self, line, node_size=16):
+        if _load_numpy() is None:
+            raise ImportError('LineIndex requires NumPy')
+        coords = getattr(line, 'coords', line)
+        coords = numpy.asarray(coords, dtype=numpy.float64)[:, :2]
+        if len(coords) < 2:
+            raise ValueError('a line needs at least two points')
+        self.coords = coords
+        self.node_size = node_size
+        self._a = coords[:-1]
+        self._ab = coords[1:] - self._a
+        self._length2 = numpy.einsum('ij,ij->i', self._ab, self._ab)
+
+        # Bounding boxes per level, starting with the segments.
+        lower = numpy.minimum(coords[:-1], coords[1:])
+        upper = numpy.maximum(coords[:-1], coords[1:])
+        self._levels = []
+        while True:
+            starts = numpy.arange(0, len(lower), node_size)
+            lower = numpy.minimum.reduceat(lower, starts)
+            upper = numpy.maximum.reduceat(upper, starts)
+            self._levels.append((lower, upper))
+            if len(lower) <= node_size:
+                break
+
+    def _locate(self, points):
+        """Return the closest segment of each of the (n, 2) ``points``,
+        and the position of the closest point on it, as in
+        ``_project()``, as a 2-tuple of arrays.
+
+        The points are paired with the candidate boxes of each level,
+        and finally with the candidate segments. The pairs are kept
+        grouped by point, and the children of a box in order, so the
+        lowest index wins among equally close segments.
+        """
+        count = len(points)
+        size = self.node_size
+        levels = self._levels[::-1] + [(None, None)]
+        owner = numpy.repeat(numpy.arange(count), len(levels[0][0]))
+        node = numpy.tile(numpy.arange(len(levels[0][0])), count)
+        for (lower, upper), (child_lower, _) in zip(levels, levels[1:]):
+            p, lower, upper = points[owner], lower[node], upper[node]
+            gap = numpy.maximum(lower - p, 0) + numpy.maximum(p - upper, 0)
+            near = numpy.minimum(abs(p - lower), abs(upper - p)) ** 2
+            far = numpy.maximum(abs(p - lower), abs(upper - p)) ** 2
+            # Every point has a pair left, so the groups are the points.
+            starts = numpy.flatnonzero(numpy.diff(owner, prepend=-1))
+            bound = numpy.minimum.reduceat(numpy.minimum(
+                near[:, 0] + far[:, 1], far[:, 0] + near[:, 1]), starts)
+            keep = numpy.einsum('ij,ij->i', gap, gap) <= bound[owner]
+            owner, node = owner[keep], node[keep]
+
+            total = len(self._a if child_lower is None else child_lower)
+            children = numpy.minimum(size, total - node * size)
+            owner = numpy.repeat(owner, children)
+            node = numpy.repeat(node * size, children) + _ranks(children)
+
+        r, dist = _positions(points[owner] - self._a[node], self._ab[node],
+                             self._length2[node])
+        starts = numpy.flatnonzero(numpy.diff(owner, prepend=-1))
+        closest = numpy.flatnonzero(
+            dist == numpy.minimum.reduceat(dist, starts)[owner])
+        closest = closest[numpy.flatnonzero(
+            numpy.diff(owner[closest], prepend=-1))]
+        return node[closest], r[closest]
+
+    def snap_point(self, x, y):
+        """Snap a single point; returns a 2-tuple (index, r), with
+        ``index`` being the closest segment, and ``r`` the position
+        of the closest point on it, as in ``_project()``.
+
+        Use ``snap()`` for many points, which handles them all at once.
+        """
+        segments, r = self._locate(numpy.array([(x, y)], dtype=numpy.float64))
+        return int(segments[0]), float(r[0])
+
+    def snap(self, points, block=4096):
+        """Snap a batch of points onto the line.
+
+        ``points`` may be a sequence of (x, y) tuples or of objects
+        with ``x`` and ``y`` attributes (like C{Point}), or an (n, 2)
+        array. Returns a 2-tuple of arrays: the
+        (n, 2) coordinates of the closest points on the line, and the
+        index of the segment each of them is on.
+
+        The points are located in blocks of ``block`` points at once.
+        """
+        points = _as_points(points)
+        result = numpy.empty((len(points), 2))
+        segments = numpy.empty(len(points), dtype=numpy.intp)
+        for start in range(0, len(points), block):
+            end = start + block
+            i, r = self._locate(points[start:end])
+            segments[start:end] = i
+            # Use the exact endpoint coordinates where possible, as
+            # ``closest_point_on_segment()`` does.
+            r = r[:, numpy.newaxis]
+            result[start:end] = numpy.where(
+                r == 0, self.coords[i],
+                numpy.where(r == 1, self.coords[i + 1],
+                            self._a[i] + self._ab[i] * r))
+        return result, segments
+
+
+def _as_points(points):
+    """Convert ``points`` (see ``LineIndex.snap()``) to an (n, 2) array.
+    """
+    if not isinstance(points, numpy.ndarray):
+        points = [(p.x, p.y) if hasattr(p, 'x') else p[:2] for p in points]
+    if not len(points):
+        return numpy.empty((0, 2))
+    points = numpy.asarray(points, dtype=numpy.float64)
+    return points.reshape(len(points), -1)[:, :2]
+
+
+def _polygon_rings(polygon):
+    """Return the rings of a polygon as a list of (n, 2) arrays.
+
+    ``polygon`` may be a single ring (a sequence of points), a sequence
+    of rings, the first being the exterior and the others holes, or
+    anything with ``exterior`` and ``interiors`` attributes, like a
+    Shapely C{Polygon}.
+    """
+    if hasattr(polygon, 'exterior'):
+        rings = [polygon.exterior] + list(polygon.interiors)
+    elif hasattr(polygon[0][0], '__len__'):
+        rings = polygon
+    else:
+        rings = [polygon]
+    return [numpy.asarray(getattr(ring, 'coords', ring),
+                          dtype=numpy.float64)[:, :2] for ring in rings]
+
+
+def _crossings(x, y, edges, max_cells=2**20):
+    """Test the points (``x``, ``y``) against the polygon formed by
+    ``edges``, an (n, 4) array of (x1, y1, x2, y2) rows. Returns a
+    boolean array, true for the points inside.
+
+    This is the crossing number test (PNPOLY): a point is inside if a
+    ray from it in +x direction crosses an odd number of edges, which
+    makes holes work without any special treatment. Points exactly on
+    the boundary may be counted either way.
+
+    The points are tested in blocks of at most ``max_cells`` point/edge
+    pairs.
+    """
+    x1, y1, x2, y2 = edges.T
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        slope = (x2 - x1) / (y2 - y1)
+    result = numpy.empty(len(x), dtype=bool)
+    step = max(1, max_cells // max(1, len(edges)))
+    for start in range(0, len(x), step):
+        px = x[start:start + step, numpy.newaxis]
+        py = y[start:start + step, numpy.newaxis]
+        # Horizontal edges never straddle the ray, so their undefined
+        # intersection does not matter.
+        with numpy.errstate(invalid='ignore'):
+            crossed = ((y1 > py) != (y2 > py)) & (px < x1 + (py - y1) * slope)
+        result[start:start + step] = numpy.count_nonzero(crossed, axis=1) % 2 == 1
+    return result
+
+
+# Cell states in ``PolygonIndex``; cells outside of a polygon are not
+# stored at all.
+_INSIDE, _BOUNDARY = 1, 2
+
+
+class PolygonIndex(object):
+    """Tests many points against many polygons at once.
+
+    ``polygons`` is a sequence of polygons, each given as described in
+    ``_polygon_rings()``: as a ring of coordinates, a list of rings
+    (exterior first, then holes), or a Shapely C{Polygon}. Requires
+    NumPy.
+
+    All polygons share one uniform grid of ``grid_size`` x ``grid_size``
+    cells over their combined bounding box (by default about one cell
+    per edge). For every polygon, each cell is classified once as
+    outside, inside, or crossed by the boundary. Points outside the
+    bounding box, or in a cell that is not crossed by any boundary, are
+    resolved without any per-point work; only the points in boundary
+    cells are tested exactly, and then only against the edges that run
+    through their row of the grid.
+
+    >>> square = ((0, 0), (10, 0), (10, 10), (0, 10))
+    >>> holed = [((20, 0), (30, 0), (30, 10), (20, 10)),
+    ...          ((22, 2), (28, 2), (28, 8), (22, 8))]
+    >>> index = PolygonIndex([square, holed, ((5, 4), (25, 4), (15, 9))])
+    >>> index.locate([(5, 5), (15, 5), (25, 5), (21, 1), (15, 8), (40, 0)]).tolist()
+    [0, 2, -1, 1, 2, -1]
+    >>> [p.tolist() for p in index.query([(5, 5), (9.5, 6), (15, 8)])]
+    [[0, 1, 1, 2], [0, 0, 2, 2]]
+    """
+
+    def __init__(self, polygons, grid_size=None):
+        if _load_numpy() is None:
+            raise ImportError('PolygonIndex requires NumPy')
+        edges, owners, bounds = [], [], []
+        for k, polygon in enumerate(polygons):
+            rings = _polygon_rings(polygon)
+            for ring in rings:
+                if len(ring) < 3:
+                    raise ValueError('a ring needs at least three points')
+                if (ring[0] != ring[-1]).any():
+                    ring = numpy.vstack((ring, ring[:1]))
+                edges.append(numpy.hstack((ring[:-1], ring[1:])))
+                owners.append(numpy.repeat(k, len(ring) - 1))
+            bounds.append(numpy.concatenate((rings[0].min(axis=0),
+                                             rings[0].max(axis=0))))
+        self.size = len(bounds)
+        if not self.size:
+            return
+        self.bounds = numpy.array(bounds)
+        edges = numpy.concatenate(edges)
+        owners = numpy.concatenate(owners)
+
+        x0, y0 = self.bounds[:, :2].min(axis=0)
+        x1, y1 = self.bounds[:, 2:].max(axis=0)
+        if grid_size is None:
+            grid_size = min(max(int(len(edges) ** 0.5), 1), 1024)
+        self._extent = x0, y0, x1, y1
+        self._grid_size = n = grid_size
+        self._scale = (x1 > x0 and n / (x1 - x0) or 0.0,
+                       y1 > y0 and n / (y1 - y0) or 0.0)
+
+        # The edges by row of the grid and polygon, for the exact tests:
+        # every edge is listed for all rows it runs through.
+        ex1, ey1, ex2, ey2 = edges.T
+        first = self._rows(numpy.minimum(ey1, ey2))
+        span = self._rows(numpy.maximum(ey1, ey2)) - first + 1
+        band_edge = numpy.repeat(numpy.arange(len(edges)), span)
+        band_row = numpy.repeat(first, span) + _ranks(span)
+        keys = band_row * self.size + owners[band_edge]
+        order = numpy.argsort(keys, kind='stable')
+        self._band_keys = keys[order]
+        self._band_edges = edges[band_edge[order]]
+
+        # The columns each edge runs through within each of its rows. Each
+        # row is widened by half a row on both sides, and the columns by
+        # one on both sides, so that rounding errors can only make the
+        # result too large.
+        row = band_row.astype(numpy.float64)
+        scale_y = self._scale[1] or 1.0
+        ya = y0 + (row - 0.5) / scale_y
+        yb = y0 + (row + 1.5) / scale_y
+        bx1, by1 = ex1[band_edge], ey1[band_edge]
+        bx2, by2 = ex2[band_edge], ey2[band_edge]
+        dy = by2 - by1
+        flat = dy == 0
+        dy[flat] = 1
+        ta = numpy.clip((ya - by1) / dy, 0, 1)
+        tb = numpy.clip((yb - by1) / dy, 0, 1)
+        ta[flat], tb[flat] = 0, 1
+        xa, xb = bx1 + ta * (bx2 - bx1), bx1 + tb * (bx2 - bx1)
+        lo = numpy.maximum(self._columns(numpy.minimum(xa, xb)) - 1, 0)
+        hi = numpy.minimum(self._columns(numpy.maximum(xa, xb)) + 1, n - 1)
+        span = hi - lo + 1
+        boundary = numpy.unique(
+            numpy.repeat(owners[band_edge] * (n * n) + band_row * n + lo, span) +
+            _ranks(span))
+
+        cells, states, polys = [], [], []
+        for k in range(self.size):
+            cell, state = self._classify(k, boundary[
+                numpy.searchsorted(boundary, k * n * n):
+                numpy.searchsorted(boundary, (k + 1) * n * n)] - k * n * n)
+            cells.append(cell)
+            states.append(state)
+            polys.append(numpy.repeat(k, len(cell)))
+        cells = numpy.concatenate(cells)
+        order = numpy.argsort(cells, kind='stable')
+        self._cell_polygons = numpy.concatenate(polys)[order]
+        self._cell_states = numpy.concatenate(states)[order]
+        self._cell_starts = numpy.concatenate(
+            ([0], numpy.cumsum(numpy.bincount(cells, minlength=n * n))))
+
+    def __len__(self):
+        return self.size
+
+    def _columns(self, x):
+        return numpy.minimum(((x - self._extent[0]) * self._scale[0])
+                             .astype(numpy.intp), self._grid_size - 1)
+
+    def _rows(self, y):
+        return numpy.minimum(((y - self._extent[1]) * self._scale[1])
+                             .astype(numpy.intp), self._grid_size - 1)
+
+    def _band(self, row, k):
+        """The edges of polygon ``k`` that run through grid row ``row``.
+        """
+        key = row * self.size + k
+        return self._band_edges[numpy.searchsorted(self._band_keys, key):
+                                numpy.searchsorted(self._band_keys, key, 'right')]
+
+    def _classify(self, k, boundary):
+        """Classify the cells within the bounding box of polygon ``k``,
+        given the sorted ids of its boundary cells. Returns the ids of
+        the cells that are inside or on the boundary, and their states.
+
+        A run of cells in a row that is not interrupted by a boundary
+        cell is either entirely inside or outside, so only the center
+        of the first cell of each run needs to be tested.
+        """
+        n = self._grid_size
+        c0, c1 = self._columns(self.bounds[k, [0, 2]])
+        r0, r1 = self._rows(self.bounds[k, [1, 3]])
+        mask = numpy.zeros((r1 - r0 + 1, c1 - c0 + 1), dtype=bool)
+        rows, columns = boundary // n, boundary % n
+        inner = (rows >= r0) & (rows <= r1) & (columns >= c0) & (columns <= c1)
+        mask[rows[inner] - r0, columns[inner] - c0] = True
+
+        # Number the runs, and find the first cell of each of them.
+        runs = numpy.cumsum(mask, axis=1) + \
+               numpy.arange(len(mask))[:, numpy.newaxis] * (mask.shape[1] + 1)
+        starts = ~mask
+        starts[:, 1:] &= mask[:, :-1]
+        inside = numpy.zeros(runs.size + len(mask), dtype=bool)
+        x0, y0 = self._extent[:2]
+        scale_x, scale_y = self._scale[0] or 1.0, self._scale[1] or 1.0
+        for r in numpy.flatnonzero(starts.any(axis=1)).tolist():
+            cols = numpy.flatnonzero(starts[r])
+            inside[runs[r, cols]] = _crossings(
+                x0 + (c0 + cols + 0.5) / scale_x,
+                numpy.repeat(y0 + (r0 + r + 0.5) / scale_y, len(cols)),
+                self._band(r0 + r, k))
+
+        state = numpy.where(mask, _BOUNDARY, numpy.where(inside[runs], _INSIDE, 0))
+        rows, columns = numpy.nonzero(state)
+        return (rows + r0) * n + columns + c0, state[rows, columns]
+
+    def query(self, points):
+        """Find all pairs of points and polygons containing them.
+
+        ``points`` may be given in any form ``LineIndex.snap()``
+        accepts. Returns a 2-tuple of arrays: the indices of the points
+        and of the polygons, sorted by point, then by polygon.
+        """
+        points = _as_points(points)
+        if not self.size:
+            return numpy.empty(0, numpy.intp), numpy.empty(0, numpy.intp)
+        x, y = points[:, 0], points[:, 1]
+        x0, y0, x1, y1 = self._extent
+        ids = numpy.flatnonzero((x >= x0) & (x <= x1) & (y >= y0) & (y <= y1))
+        rows = self._rows(y[ids])
+        cells = rows * self._grid_size + self._columns(x[ids])
+
+        # All pairs of a point and a polygon with an entry in its cell.
+        counts = numpy.diff(self._cell_starts)[cells]
+        entries = numpy.repeat(self._cell_starts[cells], counts) + _ranks(counts)
+        point, polygon = numpy.repeat(ids, counts), self._cell_polygons[entries]
+        boundary = self._cell_states[entries] == _BOUNDARY
+        found = [(point[~boundary], polygon[~boundary])]
+
+        point, polygon = point[boundary], polygon[boundary]
+        rows = numpy.repeat(rows, counts)[boundary]
+        bounds = self.bounds[polygon]
+        inner = (x[point] >= bounds[:, 0]) & (x[point] <= bounds[:, 2]) & \
+                (y[point] >= bounds[:, 1]) & (y[point] <= bounds[:, 3])
+        point, polygon, rows = point[inner], polygon[inner], rows[inner]
+
+        # Test the rest by row and polygon, so that they share the edges.
+        keys = rows * self.size + polygon
+        order = numpy.argsort(keys, kind='stable')
+        point, polygon, rows = point[order], polygon[order], rows[order]
+        keys = keys[order]
+        groups = numpy.flatnonzero(numpy.diff(keys)) + 1
+        hits = numpy.empty(len(point), dtype=bool)
+        for start, end in zip(numpy.concatenate(([0], groups)).tolist(),
+                              numpy.concatenate((groups, [len(keys)])).tolist()):
+            if start == end:
+                continue
+            p = point[start:end]
+            hits[start:end] = _crossings(
+                x[p], y[p], self._band(rows[start], polygon[start]))
+        found.append((point[hits], polygon[hits]))
+
+        point = numpy.concatenate([p for p, _ in found])
+        polygon = numpy.concatenate([k for _, k in found])
+        order = numpy.lexsort((polygon, point))
+        return point[order], polygon[order]
+
+    def locate(self, points):
+        """Return, for each point, the index of the first polygon that
+        contains it, or -1, as an array.
+        """
+        points = _as_points(points)
+        result = numpy.repeat(-1, len(points))
+        point, polygon = self.query(points)
+        first = numpy.ones(len(point), dtype=bool)
+        first[1:] = point[1:] != point[:-1]
+        result[point[first]] = polygon[first]
+        return result
+
+
+def _ranks(counts):
+    """For groups of the given sizes, laid out one after the other,
+    return the position of each element within its group.
+    """
+    counts = numpy.asarray(counts)
+    ends = numpy.cumsum(counts)
+    return numpy.arange(ends[-1] if len(ends) else 0) - \
+           numpy.repeat(ends - counts, counts)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,261 @@
+"""Processing of GPS tracks.
+
+A track is any iterable of ``(lat, lon, t)`` fixes, with latitude and
+longitude in numeric degrees, and ``t`` either a number of seconds or
+a ``datetime`` object. Tracks are consumed in a single pass, so they
+can be read straight from a file or socket.
+"""
+
+from collections import namedtuple
+from math import radians, sin, cos, asin, acos, sqrt, atan2
+
+from . import geodesy
+from .geodesy import EARTH_RADIUS, GeoPoint
+
+
+__all__ = ('Leg', 'track_legs', 'TrackStats', 'simplify_track',)
+
+
+Leg = namedtuple('Leg', 'start end distance bearing duration speed')
+Leg.__doc__ = """The way between two consecutive fixes of a track.
+
+``start`` and ``end`` are the fixes as given, ``distance`` is in km,
+``bearing`` the initial bearing in degrees, ``duration`` in seconds
+and ``speed`` in km/h (``None`` if no time passed between the fixes).
+"""
+
+
+def _seconds(delta):
+    if hasattr(delta, 'total_seconds'):
+        return delta.total_seconds()
+    return delta
+
+
+def track_legs(fixes):
+    """Yield a ``Leg`` for every pair of consecutive fixes.
+
+    Every fix is converted to a ``GeoPoint`` once, so the trigonometry
+    for the start of a leg is not repeated for its distance and bearing.
+
+    >>> for leg in track_legs([(48.76165, 11.41947, 0), (48.75857, 11.42501, 60),
+    ...                        (48.76176, 11.41595, 120)]):
+    ...     print("%.3f %.1f %.1f" % (leg.distance, leg.bearing, leg.speed))
+    0.531 130.1 31.9
+    0.753 298.1 45.2
+
+    A leg without movement has a speed of 0, one without time passing
+    none:
+
+    >>> [leg.speed for leg in track_legs([(1, 2, 0), (1, 2, 60), (1, 2, 60)])]
+    [0.0, None]
+    """
+    prev = prev_point = None
+    for fix in fixes:
+        lat, lon = fix[0], fix[1]
+        if prev is not None:
+            distance = prev_point.distance_haversine(lat, lon)
+            duration = _seconds(fix[2] - prev[2])
+            yield Leg(prev, fix, distance, prev_point.bearing_degrees(lat, lon),
+                      duration, distance / duration * 3600 if duration else None)
+        prev, prev_point = fix, GeoPoint(lat, lon)
+
+
+class TrackStats(object):
+    """Running aggregates over the legs of a track, in constant memory.
+
+    Use ``consume()`` to pass the legs through while they are counted,
+    or ``update()`` to add legs yourself:
+
+    >>> stats = TrackStats()
+    >>> fixes = [(48.76165, 11.41947, 0), (48.75857, 11.42501, 60),
+    ...          (48.76176, 11.41595, 120)]
+    >>> for leg in stats.consume(fixes):
+    ...     pass
+    >>> "%d %.3f %d %.1f %.1f" % (stats.legs, stats.distance, stats.duration,
+    ...                           stats.average_speed, stats.max_speed)
+    '2 1.284 120 38.5 45.2'
+    """
+
+    def __init__(self):
+        self.legs = 0
+        self.distance = 0.0
+        self.duration = 0
+        self.max_speed = None
+
+    @property
+    def average_speed(self):
+        """Average speed in km/h, or ``None`` if no time has passed.
+        """
+        if not self.duration:
+            return None
+        return self.distance / self.duration * 3600
+
+    def update(self, leg):
+        self.legs += 1
+        self.distance += leg.distance
+        self.duration += leg.duration
+        if leg.speed is not None and (self.max_speed is None or
+                                      leg.speed > self.max_speed):
+            self.max_speed = leg.speed
+
+    def consume(self, fixes):
+        """Yield the legs of the track given by ``fixes``, as
+        ``track_legs()`` does, while updating the statistics.
+        """
+        for leg in track_legs(fixes):
+            self.update(leg)
+            yield leg
+
+
+def _furthest(phi, lam, sin_phi, cos_phi):
+    """Find the point furthest away from the segment between the first
+    and the last of the given points (in radians, with sine and cosine
+    of the latitudes). Returns a 2-tuple (index, error in km).
+
+    The error is the distance to the segment, as measured by
+    ``geodesy.cross_track_route()``: the cross track distance where the
+    foot of the perpendicular lies on the segment, the distance to the
+    nearer endpoint otherwise. It is inlined here so that bearing and
+    length of the segment are only calculated once.
+    """
+    phiA, lamA, sinA, cosA = phi[0], lam[0], sin_phi[0], cos_phi[0]
+    phiB, lamB, sinB, cosB = phi[-1], lam[-1], sin_phi[-1], cos_phi[-1]
+    degenerate = phiA == phiB and lamA == lamB
+    dlon = lamB - lamA
+    brng12 = atan2(sin(dlon) * cosB, cosA * sinB - sinA * cosB * cos(dlon))
+    a = sin((phiB - phiA) / 2) ** 2 + cosA * cosB * sin(dlon / 2) ** 2
+    d12 = 2 * atan2(sqrt(a), sqrt(1 - a))
+
+    best, k = -1.0, 1
+    for n in range(1, len(phi) - 1):
+        dlat, dlon = phi[n] - phiA, lam[n] - lamA
+        a = sin(dlat / 2) ** 2 + cosA * cos_phi[n] * sin(dlon / 2) ** 2
+        error = 2 * atan2(sqrt(a), sqrt(1 - a))
+        if not degenerate:
+            dtheta = atan2(sin(dlon) * cos_phi[n],
+                           cosA * sin_phi[n] - sinA * cos_phi[n] * cos(dlon)) - brng12
+            xt = asin(sin(error) * sin(dtheta))
+            at = acos(max(-1.0, min(1.0, cos(error) / cos(xt)))) if cos(xt) else 0.0
+            if cos(dtheta) < 0:
+                at = -at
+            if 0 <= at <= d12:
+                error = abs(xt)
+            else:
+                dlat, dlon = phi[n] - phiB, lam[n] - lamB
+                a = sin(dlat / 2) ** 2 + cosB * cos_phi[n] * sin(dlon / 2) ** 2
+                error = min(error, 2 * atan2(sqrt(a), sqrt(1 - a)))
+        if error > best:
+            best, k = error, n
+    return k, best * EARTH_RADIUS
+
+
+def _furthest_array(phi, lam, sin_phi, cos_phi):
+    """NumPy version of ``_furthest()``.
+    """
+    numpy = geodesy.numpy
+    phiA, lamA, sinA, cosA = phi[0], lam[0], sin_phi[0], cos_phi[0]
+    phiB, lamB, sinB, cosB = phi[-1], lam[-1], sin_phi[-1], cos_phi[-1]
+    dlon = lamB - lamA
+    brng12 = atan2(sin(dlon) * cosB, cosA * sinB - sinA * cosB * cos(dlon))
+    a = sin((phiB - phiA) / 2) ** 2 + cosA * cosB * sin(dlon / 2) ** 2
+    d12 = 2 * atan2(sqrt(a), sqrt(1 - a))
+
+    def distances(phi0, lam0, cos0):
+        a = numpy.sin((phi[1:-1] - phi0) / 2) ** 2 + \
+            cos0 * cosP * numpy.sin((lam[1:-1] - lam0) / 2) ** 2
+        a = numpy.minimum(a, 1.0)
+        return 2 * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))
+
+    sinP, cosP = sin_phi[1:-1], cos_phi[1:-1]
+    errors = distances(phiA, lamA, cosA)
+    if not (phiA == phiB and lamA == lamB):
+        dlon = lam[1:-1] - lamA
+        dtheta = numpy.arctan2(numpy.sin(dlon) * cosP,
+                               cosA * sinP - sinA * cosP * numpy.cos(dlon)) - brng12
+        xt = numpy.arcsin(numpy.clip(numpy.sin(errors) * numpy.sin(dtheta), -1, 1))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            at = numpy.arccos(numpy.clip(numpy.cos(errors) / numpy.cos(xt), -1, 1))
+        at[numpy.cos(dtheta) < 0] *= -1
+        inside = (at >= 0) & (at <= d12)
+        errors = numpy.where(inside, numpy.abs(xt),
+                             numpy.minimum(errors, distances(phiB, lamB, cosB)))
+    k = int(numpy.argmax(errors))
+    return k + 1, float(errors[k]) * EARTH_RADIUS
+
+
+def simplify_track(points, tolerance, vectorized=None):
+    """Simplify a track using the Douglas-Peucker algorithm, with the
+    cross track distance (see ``geodesy.cross_track()``) as the error
+    measure, clamped to the segment as in ``geodesy.cross_track_route()``.
+    ``tolerance`` is the maximum error, in km.
+
+    ``points`` is a sequence of fixes (only the first two items of
+    each, lat and lon, are looked at); the fixes that are kept are
+    returned as a list, in their original order.
+
+    The algorithm uses an explicit stack rather than recursion, so the
+    length of the track is not limited by the recursion limit. With
+    ``vectorized`` set (the default if NumPy is available), the search
+    for the point furthest from a segment runs over NumPy arrays.
+
+    >>> track = [(0, 0), (0.001, 0.5), (0, 1), (0.5, 1.5), (0, 2)]
+    >>> simplify_track(track, 1)
+    [(0, 0), (0, 1), (0.5, 1.5), (0, 2)]
+    >>> simplify_track(track, 1, vectorized=False)
+    [(0, 0), (0, 1), (0.5, 1.5), (0, 2)]
+    >>> simplify_track(track, 100)
+    [(0, 0), (0, 2)]
+
+    As points are measured against the segment rather than the great
+    circle through it, excursions that turn back are kept:
+
+    >>> simplify_track([(0, 0), (0, 2), (0, 1)], 1)
+    [(0, 0), (0, 2), (0, 1)]
+    """
+    if vectorized is None:
+        vectorized = geodesy.numpy is not None
+    points = list(points)
+    if len(points) < 3:
+        return points
+
+    # Radians and the trigonometry of the latitudes are computed once
+    # for all points upfront.
+    if vectorized:
+        numpy = geodesy.numpy
+        phi = numpy.radians([p[0] for p in points])
+        lam = numpy.radians([p[1] for p in points])
+        sin_phi, cos_phi = numpy.sin(phi), numpy.cos(phi)
+
+        def furthest(i, j):
+            values = phi[i:j+1], lam[i:j+1], sin_phi[i:j+1], cos_phi[i:j+1]
+            # For short segments, the overhead of the NumPy calls is
+            # larger than the work they save.
+            if j - i < 64:
+                return _furthest(*[v.tolist() for v in values])
+            return _furthest_array(*values)
+    else:
+        phi = [radians(p[0]) for p in points]
+        lam = [radians(p[1]) for p in points]
+        sin_phi, cos_phi = [sin(v) for v in phi], [cos(v) for v in phi]
+
+        def furthest(i, j):
+            return _furthest(phi[i:j+1], lam[i:j+1],
+                             sin_phi[i:j+1], cos_phi[i:j+1])
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        k, error = furthest(i, j)
+        if error > tolerance:
+            keep[i + k] = True
+            stack.append((i, i + k))
+            stack.append((i + k, j))
+    return [p for p, k in zip(points, keep) if k]
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()